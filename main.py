@@ -1,243 +1,217 @@
-import asyncio
-from logging import debug
-
-from curl_cffi.requests import AsyncSession
-from flasgger import Swagger
-from flask import Flask, jsonify, request
-from flask_cors import CORS
-
-from src.film import get_film_by_id
-from src.get_list import get_list as fetch_list
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+
+import uvicorn
+from fastapi import FastAPI, Query, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from src.film import FILM_FIELDS, HYDRATE_FIELDS, hydrate_films
+from src.film import get_film as resolve_film
+from src.get_list import get_list as fetch_list, iter_list
 from src.recomender import (
+    RANKED_SIZE,
+    compute_ranked_batch,
     get_ranked_by_seeds_cached,
     get_ranked_cached,
+    id_to_film,
 )
-from src.cache import cache, cache_slow
-
-from src.search import get_film_by_name
+from src.cache import cache, cache_aside, cache_slow, film_cache
+from src.governor import UpstreamError
+from src.metrics import snapshot
+
+from src.parser import shutdown_executor
+from src.search import get_film_by_name, search_timeout
+from src.session import get_session, pool
+from src.typeahead import TYPEAHEAD_LIMIT, normalize_query, index as typeahead_index
 from src.users import get_user_diary_page, get_user_favorites_handler
 
-app = Flask(__name__)
-swagger = Swagger(app)
-cors = CORS(app)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await pool.start()
+    await film_cache.start()
+    typeahead_index.build(id_to_film)
+    yield
+    await film_cache.stop()
+    await pool.close()
+    await cache.close()
+    await cache_slow.close()
+    shutdown_executor()
 
-cache.init_app(app)
-cache_slow.init_app(app)
+
+app = FastAPI(
+    title="Letterboxd API",
+    docs_url="/apidocs/",
+    lifespan=lifespan,
+)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@app.exception_handler(UpstreamError)
+async def upstream_error(request: Request, exc: UpstreamError):
+    # Letterboxd failed or throttled us; tell the client to come back later
+    # rather than returning a partial result.
+    headers = {"Retry-After": str(int(exc.retry_after))} if exc.retry_after else None
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Letterboxd is unavailable, try again later"},
+        headers=headers,
+    )
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0",
 }
 
 
-@app.route("/film/<string:id>", methods=["GET"])
-async def get_film(id):
-    """
-    Get film details by ID
-    ---
-    tags:
-      - Film
-    parameters:
-      - name: id
-        in: path
-        type: string
-        required: true
-        description: The ID of the film
-    responses:
-      200:
-        description: Film data retrieved successfully
-    """
-    key = f"film:{id}"
-    if cache_slow.get(key):
-        data = cache_slow.get(key)
-        return jsonify(data)
-    data = await get_film_by_id(f"/film/{id}")
-    cache_slow.set(key, data)
-    return jsonify(data)
-
-
-@app.route("/diary/<string:user_id>", methods=["GET"])
-async def get_dialy_user(user_id):
-    """
-    Get user diary entries
-    ---
-    tags:
-      - Users
-    parameters:
-      - name: user_id
-        in: path
-        type: string
-        required: true
-      - name: page
-        in: query
-        type: integer
-        default: 1
-        description: Page number for pagination
-    responses:
-      200:
-        description: User diary data
-    """
-    page = request.args.get("page", default=1, type=int)
-
-    async with AsyncSession(impersonate="chrome") as session:
-        data = await get_user_diary_page(session, user_id, page)
-    return jsonify(data)
-
-@app.route("/favorites/<string:user_id>", methods=["GET"])
-async def get_favorite_user(user_id):
-    """
-    Get user favorites 
-    ---
-    tags:
-      - Users
-    parameters:
-      - name: user_id
-        in: path
-        type: string
-        required: true
-      - name: page
-        in: query
-        type: integer
-        default: 1
-        description: Page number for pagination
-    responses:
-      200:
-        description: User diary data
-    """
-    page = request.args.get("page", default=1, type=int)
-
-    async with AsyncSession(impersonate="chrome") as session:
-        data = await get_user_favorites_handler(session, user_id)
-    return jsonify(data)
-
-
-@app.route("/recommend/personalize/<string:user_id>", methods=["GET"])
-async def get_recommend_user(user_id):
-    """
-    Get personalized recommendations for a user
-    ---
-    tags:
-      - Recommendations
-    parameters:
-      - name: user_id
-        in: path
-        type: string
-        required: true
-      - name: k
-        in: query
-        type: integer
-        default: 1
-        description: Number of recommendations to return
-    responses:
-      200:
-        description: List of recommended films
-    """
-    k = request.args.get("k", default=1, type=int)
-
-    data = await get_ranked_cached(user_id, k)
-    return jsonify(data)
-
-
-@app.route("/recommend/seed", methods=["POST"])
-async def get_recommend_seed():
-    """
-    POST recommendations based on seed films
-    ---
-    tags:
-      - Recommendations
-    parameters:
-      - name: body
-        in: body
-        required: true
-        schema:
-          type: object
-          properties:
-            seed_film_ids:
-              type: array
-              items:
-                type: string
-              example: ["film_1", "film_2"]
-            k:
-              type: integer
-              default: 1
-    responses:
-      200:
-        description: List of recommended films based on seeds
-    """
-    body = request.get_json()
-    seed_film_ids = body.get("seed_film_ids", [])
-    k = body.get("k", 1)
-
-    data = await get_ranked_by_seeds_cached(seed_film_ids, k)
-    return jsonify(data)
-
-
-@app.route("/get_list", methods=["GET"])
-async def get_list():
-    """
-    Fetch a list from Letterboxd
-    ---
-    tags:
-      - Lists
-    parameters:
-      - name: list_url
-        in: query
-        type: string
-        default: "https://letterboxd.com/official/list/top-250-films-with-the-most-fans"
-        description: The Letterboxd film from list, actor, director, watchlist etc from url
-      - name: page
-        in: query
-        type: integer
-        description: Specific page number to fetch (returns all pages if not specified)
-      - name: limit
-        in: query
-        type: integer
-        description: Maximum number of films to return
-    responses:
-      200:
-        description: The fetched list data
-    """
-    list_url = request.args.get(
-        "list_url", default="https://letterboxd.com/official/list/top-250-films-with-the-most-fans", type=str
-    )
-    page = request.args.get("page", default=None, type=int)
-    limit = request.args.get("limit", default=None, type=int)
+FilmField = Literal[FILM_FIELDS]
+
+
+class SeedRequest(BaseModel):
+    seed_film_ids: list[str] = []
+    k: int = Field(RANKED_SIZE, ge=1, le=RANKED_SIZE)
+    offset: int = Field(0, ge=0, lt=RANKED_SIZE)
+    hydrate: bool = False
+    fields: list[FilmField] = list(HYDRATE_FIELDS)
+
+    model_config = {
+        "json_schema_extra": {"example": {"seed_film_ids": ["film_1", "film_2"], "k": 20, "offset": 0}}
+    }
+
+
+class BatchRequest(BaseModel):
+    users: list[str] = []
+    seeds: list[list[str]] = []
+    k: int = Field(100, ge=1, le=1000)
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {"users": ["user_1", "user_2"], "seeds": [["film_1", "film_2"]], "k": 100}
+        }
+    }
+
+
+@app.get("/film/{id}", tags=["Film"])
+async def get_film(id: str):
+    """Get film details by ID"""
+    return await resolve_film(id)
+
+
+@app.get("/diary/{user_id}", tags=["Users"])
+async def get_dialy_user(
+    user_id: str,
+    page: int = Query(1, description="Page number for pagination"),
+):
+    """Get user diary entries"""
+    data = await get_user_diary_page(get_session(), user_id, page)
+    return data
+
+
+@app.get("/favorites/{user_id}", tags=["Users"])
+async def get_favorite_user(user_id: str):
+    """Get user favorites"""
+    data = await get_user_favorites_handler(get_session(), user_id)
+    return data
+
+
+@app.get("/recommend/personalize/{user_id}", tags=["Recommendations"])
+async def get_recommend_user(
+    user_id: str,
+    k: int = Query(RANKED_SIZE, ge=1, le=RANKED_SIZE, description="Number of recommendations to return"),
+    offset: int = Query(0, ge=0, lt=RANKED_SIZE, description="Rank of the first recommendation"),
+    hydrate: bool = Query(False, description="Return film details instead of bare film ids"),
+    fields: list[FilmField] = Query(list(HYDRATE_FIELDS), description="Film details to include when hydrating"),
+):
+    """Get personalized recommendations for a user"""
+    data = await get_ranked_cached(user_id, k, offset)
+    if hydrate:
+        data = await hydrate_films(data, fields)
+    return data
+
+
+@app.post("/recommend/seed", tags=["Recommendations"])
+async def get_recommend_seed(body: SeedRequest):
+    """POST recommendations based on seed films"""
+    data = await get_ranked_by_seeds_cached(body.seed_film_ids, body.k, body.offset)
+    if body.hydrate:
+        data = await hydrate_films(data, body.fields)
+    return data
+
+
+@app.post("/recommend/batch", tags=["Recommendations"])
+async def get_recommend_batch(body: BatchRequest):
+    """Recommendations for many users and seed sets in one scoring pass"""
+    data = await compute_ranked_batch(body.users, body.seeds, body.k)
+    return data
+
+
+@app.get("/get_list", tags=["Lists"])
+async def get_list(
+    list_url: str = Query(
+        "https://letterboxd.com/official/list/top-250-films-with-the-most-fans",
+        description="The Letterboxd film from list, actor, director, watchlist etc from url",
+    ),
+    page: Optional[int] = Query(
+        None, description="Specific page number to fetch (returns all pages if not specified)"
+    ),
+    limit: Optional[int] = Query(None, description="Maximum number of films to return"),
+    stream: bool = Query(False, description="Stream entries as NDJSON as pages arrive"),
+):
+    """Fetch a list from Letterboxd"""
+    if stream:
+        async def lines():
+            async for entry in iter_list(list_url, page=page, limit=limit):
+                yield json.dumps(entry) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
 
     data = await fetch_list(list_url, page=page, limit=limit)
-    return jsonify(data)
-
-
-@app.route("/search", methods=["GET"])
-async def search_films():
-    """
-    Search for films by name
-    ---
-    tags:
-      - Film
-    parameters:
-      - name: query
-        in: query
-        type: string
-        required: true
-        description: The search query for the film name
-    responses:
-      200:
-        description: List of films matching the search query
-    """
-    query = request.args.get("query", default="", type=str)
+    return data
+
+
+@app.get("/search", tags=["Film"])
+async def search_films(
+    query: str = Query("", description="The search query for the film name"),
+    details: bool = Query(False, description="Attach full film details to every result"),
+):
+    """Search for films by name"""
+    query = normalize_query(query)
     if not query:
-        return jsonify([])
+        return []
+
+    key = f"search:details:{query}" if details else f"search:{query}"
+    data = await cache_aside(
+        cache_slow,
+        key,
+        lambda: get_film_by_name(query, details),
+        timeout=lambda datas: search_timeout(datas, details),
+    )
+    typeahead_index.add_results(data)
+    return data
+
 
-    key = f"search:{query}"
+@app.get("/search/typeahead", tags=["Film"])
+async def search_typeahead(
+    query: str = Query("", description="Prefix of a film name"),
+    limit: int = Query(TYPEAHEAD_LIMIT, ge=1, le=100, description="Maximum number of suggestions"),
+):
+    """Film name suggestions from the local index, without an upstream request"""
+    return typeahead_index.search(query, limit)
 
-    if cache_slow.get(key):
-        data = cache_slow.get(key)
-        return jsonify(data)
 
-    data = await get_film_by_name(query)
-    cache_slow.set(key, data)
-    return jsonify(data)
+@app.get("/metrics", tags=["Metrics"])
+async def get_metrics():
+    """Per-worker cache and upstream counters"""
+    return snapshot()
 
 
 if __name__ == "__main__":
-    app.run(debug=False, host="0.0.0.0", port=5000)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=5000,
+        workers=int(os.environ.get("WEB_CONCURRENCY", "1")),
+    )
@@ -0,0 +1,176 @@
+"""Inverted-file (IVF) index over the item factors.
+
+Items are clustered with k-means; a query only scores the items in the
+``nprobe`` clusters whose centroids have the highest inner product with
+it. Built once at model load and saved next to the model.
+
+Compare against exact scoring with::
+
+    python -m src.ann [model_dir]
+"""
+
+import hashlib
+import os
+import sys
+import time
+
+import numpy as np
+
+IVF_LISTS = int(os.environ.get("IVF_LISTS", "0"))  # 0 = sqrt(items)
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "32"))
+
+# rows per chunk when assigning items to centroids
+ASSIGN_CHUNK = 8192
+
+
+def fingerprint(item_factors) -> str:
+    """Hash of the factor values, so an index is never reused for other factors."""
+    vectors = np.ascontiguousarray(item_factors, dtype=np.float32)
+    return hashlib.sha1(vectors.tobytes()).hexdigest()
+
+
+def _assign(vectors, centroids):
+    labels = np.empty(len(vectors), dtype=np.int32)
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = vectors[start:start + ASSIGN_CHUNK]
+        # argmin ||x - c||^2 == argmax x.c - ||c||^2 / 2
+        labels[start:start + ASSIGN_CHUNK] = np.argmax(chunk @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+class IVFIndex:
+    def __init__(self, centroids, offsets, items, vectors, fingerprint=None):
+        self.centroids = centroids
+        self.offsets = offsets  # items[offsets[l]:offsets[l + 1]] belong to list l
+        self.items = items
+        self.vectors = vectors  # item factors in ``items`` order, so lists are contiguous
+        self.fingerprint = fingerprint  # of the item factors the index was built from
+
+    @classmethod
+    def build(cls, item_factors, n_lists=IVF_LISTS, iterations=10, seed=0):
+        vectors = np.asarray(item_factors, dtype=np.float32)
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = _assign(vectors, centroids)
+            counts = np.bincount(labels, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, vectors)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        labels = _assign(vectors, centroids)
+        items = np.argsort(labels, kind="stable").astype(np.int32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        return cls(centroids, offsets, items, vectors[items], fingerprint(vectors))
+
+    def search(self, query, k, nprobe=IVF_NPROBE, exclude=None):
+        """Top ``k`` item ids for ``query`` by inner product, best first."""
+        exclude = np.asarray(exclude if exclude is not None else [], dtype=np.int64)
+        order = np.argsort(-(self.centroids @ query))
+        sizes = self.offsets[order + 1] - self.offsets[order]
+
+        # probe at least nprobe lists, and enough of them to fill k results
+        needed = k + len(exclude)
+        probe = max(nprobe, int(np.searchsorted(np.cumsum(sizes), needed)) + 1)
+        lists = order[:probe]
+
+        spans = [(self.offsets[l], self.offsets[l + 1]) for l in lists]
+        candidates = np.concatenate([self.items[a:b] for a, b in spans])
+        scores = np.concatenate([self.vectors[a:b] @ query for a, b in spans])
+        if len(exclude):
+            keep = ~np.isin(candidates, exclude)
+            candidates, scores = candidates[keep], scores[keep]
+        if not len(candidates):
+            return candidates
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return candidates[top]
+
+    def save(self, model_dir):
+        np.save(os.path.join(model_dir, "ivf_centroids.npy"), self.centroids)
+        np.save(os.path.join(model_dir, "ivf_offsets.npy"), self.offsets)
+        np.save(os.path.join(model_dir, "ivf_items.npy"), self.items)
+        np.save(os.path.join(model_dir, "ivf_vectors.npy"), self.vectors)
+        # written last: a half-saved index has no fingerprint and gets rebuilt
+        with open(os.path.join(model_dir, "ivf_fingerprint.txt"), "w") as f:
+            f.write(self.fingerprint)
+
+    @classmethod
+    def load(cls, item_factors, model_dir):
+        def load(name):
+            return np.load(os.path.join(model_dir, f"{name}.npy"), mmap_mode="r")
+
+        with open(os.path.join(model_dir, "ivf_fingerprint.txt")) as f:
+            saved = f.read().strip()
+        offsets = load("ivf_offsets")
+        if offsets[-1] != len(item_factors) or saved != fingerprint(item_factors):
+            raise ValueError("IVF index was built for a different model")
+        return cls(load("ivf_centroids"), offsets, load("ivf_items"), load("ivf_vectors"), saved)
+
+
+def load_or_build(item_factors, model_dir):
+    try:
+        return IVFIndex.load(item_factors, model_dir)
+    except (OSError, ValueError):
+        pass
+
+    index = IVFIndex.build(item_factors)
+    try:
+        index.save(model_dir)
+    except OSError as e:
+        print(f"Could not save IVF index to {model_dir}: {e}")
+    return index
+
+
+def exact_search(item_factors, query, k, exclude=None):
+    scores = item_factors @ query
+    if exclude is not None:
+        scores[exclude] = -np.inf
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def benchmark(model_dir, queries=200, k=100, seed=0):
+    from src.model_store import load_model
+
+    model, _, _ = load_model(model_dir)
+    item_factors = np.asarray(model.item_factors)
+
+    start = time.perf_counter()
+    index = load_or_build(item_factors, model_dir)
+    print(f"index ready in {time.perf_counter() - start:.2f}s, {len(index.centroids)} lists")
+
+    rng = np.random.default_rng(seed)
+    users = np.asarray(model.user_factors)
+    users = users[rng.choice(len(users), min(queries, len(users)), replace=False)]
+
+    for nprobe in (4, 8, 16, 32, 64):
+        recall = exact_time = ann_time = 0.0
+        for query in users:
+            t0 = time.perf_counter()
+            exact = exact_search(item_factors, query, k)
+            t1 = time.perf_counter()
+            approx = index.search(query, k, nprobe=nprobe)
+            t2 = time.perf_counter()
+            exact_time += t1 - t0
+            ann_time += t2 - t1
+            recall += len(np.intersect1d(exact, approx)) / k
+        n = len(users)
+        print(
+            f"nprobe={nprobe:3d} recall@{k}={recall / n:.3f} "
+            f"exact={exact_time / n * 1000:.3f}ms ivf={ann_time / n * 1000:.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    from src.model_store import MODEL_DIR
+
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else MODEL_DIR)
@@ -1,25 +1,594 @@
+import asyncio
+import json
 import os
+import pickle
+import time
+import uuid
+from collections import OrderedDict
 
-from flask_caching import Cache
-
-# Cache 1: Fast cache (1 hour timeout)
-cache = Cache(
-    config={
-        "CACHE_TYPE": "RedisCache",
-        "CACHE_REDIS_HOST": os.environ.get("REDIS_HOST", "localhost"),
-        "CACHE_REDIS_PORT": int(os.environ.get("REDIS_PORT", "6379")),
-        "CACHE_REDIS_DB": 0,
-        "CACHE_DEFAULT_TIMEOUT": 360,  # 1 hour
-    }
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+
+from src.metrics import incr
+from src.singleflight import flight
+
+# How long a failed upstream lookup is remembered before it is retried.
+NEGATIVE_TIMEOUT = int(os.environ.get("CACHE_NEGATIVE_TIMEOUT", "300"))
+
+# Cross-worker single flight: a miss takes a Redis lock so only one worker
+# fills a key while the others wait for the value to appear.
+CACHE_LOCKS = os.environ.get("CACHE_LOCKS", "0") == "1"
+LOCK_TIMEOUT = int(os.environ.get("CACHE_LOCK_TIMEOUT", "60"))
+LOCK_POLL_INTERVAL = 0.1
+
+# In-process tier in front of Redis for hot, rarely changing values.
+L1_MAX_BYTES = int(os.environ.get("CACHE_L1_MAX_BYTES", str(64 * 1024 * 1024)))
+L1_TIMEOUT = int(os.environ.get("CACHE_L1_TIMEOUT", "60"))
+# Broadcast writes so other workers drop their local copy.
+L1_INVALIDATION = os.environ.get("CACHE_L1_INVALIDATION", "1") == "1"
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Stale-while-revalidate: with a soft timeout an entry also gets a marker
+# key that expires first. Past it the stale value is still served while a
+# single background task refreshes it; attempts for a key are spaced at
+# least REFRESH_INTERVAL apart, doubling after each failure.
+REFRESH_INTERVAL = int(os.environ.get("CACHE_REFRESH_INTERVAL", "30"))
+REFRESH_MAX_BACKOFF = int(os.environ.get("CACHE_REFRESH_MAX_BACKOFF", "900"))
+FRESH_SUFFIX = ":fresh"
+# Keys whose failed refreshes are remembered per worker; the oldest are
+# forgotten first, so keys that never come back cannot grow it forever.
+REFRESH_FAILURES_MAX = int(os.environ.get("CACHE_REFRESH_FAILURES_MAX", "10000"))
+
+
+class _Negative:
+    """Tombstone stored in place of a value the upstream could not produce."""
+
+    def __reduce__(self):
+        # Unpickle to the module singleton so ``is NEGATIVE`` checks hold.
+        return "NEGATIVE"
+
+    def __repr__(self):
+        return "NEGATIVE"
+
+
+NEGATIVE = _Negative()
+
+
+class RedisCache:
+    """Asyncio Redis cache storing pickled values.
+
+    Batched reads go through a single MGET and batched writes through one
+    pipelined round trip, so callers never block the event loop and never
+    issue one request per key.
+    """
+
+    def __init__(self, name, host="localhost", port=6379, db=0, default_timeout=300, key_prefix=""):
+        self.name = name
+        self.client = Redis(host=host, port=port, db=db)
+        self.default_timeout = default_timeout
+        self.key_prefix = key_prefix
+
+    def _key(self, key):
+        return f"{self.key_prefix}{key}"
+
+    def _timeout(self, timeout):
+        # 0 means the entry never expires
+        timeout = self.default_timeout if timeout is None else timeout
+        return timeout or None
+
+    @staticmethod
+    def dumps(value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(raw):
+        if raw is None:
+            return None
+        return pickle.loads(raw)
+
+    async def get_raw(self, key):
+        return await self.client.get(self._key(key))
+
+    async def get_many_raw(self, keys):
+        if not keys:
+            return []
+        return await self.client.mget([self._key(k) for k in keys])
+
+    async def get(self, key):
+        return self.loads(await self.get_raw(key))
+
+    async def get_many(self, keys):
+        """Return the values for ``keys`` in order, ``None`` for misses."""
+        return [self.loads(raw) for raw in await self.get_many_raw(keys)]
+
+    async def set(self, key, value, timeout=None):
+        await self.client.set(self._key(key), self.dumps(value), ex=self._timeout(timeout))
+
+    async def set_many(self, mapping, timeout=None):
+        await self.set_many_raw({key: self.dumps(value) for key, value in mapping.items()}, timeout)
+
+    async def set_many_raw(self, mapping, timeout=None):
+        if not mapping:
+            return
+        ex = self._timeout(timeout)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, raw in mapping.items():
+                pipe.set(self._key(key), raw, ex=ex)
+            await pipe.execute()
+
+    async def get_range_marked(self, key, marker, start, end):
+        """:meth:`get_range` plus whether ``marker`` exists, in one round trip."""
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.exists(self._key(key))
+            pipe.getrange(self._key(key), start, end)
+            pipe.exists(self._key(marker))
+            exists, raw, marked = await pipe.execute()
+        return (raw if exists else None), bool(marked)
+
+    async def get_range(self, key, start, end):
+        """Raw bytes ``start..end`` (inclusive) of a :meth:`set_raw` value.
+
+        Returns ``None`` when the key does not exist, so an empty stored
+        value and a miss can be told apart.
+        """
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.exists(self._key(key))
+            pipe.getrange(self._key(key), start, end)
+            exists, raw = await pipe.execute()
+        return raw if exists else None
+
+    async def set_raw(self, key, data: bytes, timeout=None):
+        """Store ``data`` unpickled, for values read back with :meth:`get_range`."""
+        await self.client.set(self._key(key), data, ex=self._timeout(timeout))
+
+    async def add(self, key, value, timeout=None):
+        """Set ``key`` only if it does not exist; returns whether it was set."""
+        return bool(
+            await self.client.set(self._key(key), self.dumps(value), ex=self._timeout(timeout), nx=True)
+        )
+
+    def lock(self, key, timeout=LOCK_TIMEOUT):
+        return self.client.lock(self._key(f"lock:{key}"), timeout=timeout)
+
+    async def delete(self, *keys):
+        if keys:
+            await self.client.delete(*[self._key(k) for k in keys])
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class LocalCache:
+    """Per-process LRU bounded by the (pickled) size of its values.
+
+    Entries also expire after ``timeout`` seconds, which bounds how stale a
+    worker can be if an invalidation message is lost.
+    """
+
+    def __init__(self, max_bytes=L1_MAX_BYTES, timeout=L1_TIMEOUT):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, size, timeout=None):
+        self.pop(key)
+        if size > self.max_bytes:
+            return
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        self._entries[key] = (time.monotonic() + timeout, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.size -= evicted
+            incr("l1.evicted")
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache:
+    """A :class:`LocalCache` in front of a :class:`RedisCache`.
+
+    Has the same interface as ``RedisCache`` so it can be passed to
+    :func:`cache_aside` and :func:`cache_aside_many`. Reads try the local
+    tier first; writes go to both and are published on
+    ``INVALIDATION_CHANNEL`` so other workers evict their copy. Hits are
+    counted per tier as ``{name}.l1.*`` and ``{name}.l2.*``; freshness
+    markers read along with their values are left out of those counts.
+    """
+
+    def __init__(self, name, remote: RedisCache, local: LocalCache = None, invalidation=L1_INVALIDATION):
+        self.name = name
+        self.remote = remote
+        self.local = local or LocalCache()
+        self.invalidation = invalidation
+        self.sender = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._listener = None
+
+    def _count(self, tier, key, hit):
+        if not key.endswith(FRESH_SUFFIX):
+            incr(f"{self.name}.{tier}.{'hit' if hit else 'miss'}")
+
+    def _local_get(self, key):
+        value = self.local.get(key)
+        self._count("l1", key, value is not None)
+        return value
+
+    def _remember(self, key, raw):
+        self._count("l2", key, raw is not None)
+        if raw is None:
+            return None
+        value = self.remote.loads(raw)
+        self.local.set(key, value, len(raw))
+        return value
+
+    async def get(self, key):
+        value = self._local_get(key)
+        if value is not None:
+            return value
+        return self._remember(key, await self.remote.get_raw(key))
+
+    async def get_many(self, keys):
+        values = [self._local_get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        raws = await self.remote.get_many_raw([keys[i] for i in missing])
+        for i, raw in zip(missing, raws):
+            values[i] = self._remember(keys[i], raw)
+        return values
+
+    async def set(self, key, value, timeout=None):
+        await self.set_many({key: value}, timeout=timeout)
+
+    async def set_many(self, mapping, timeout=None):
+        if not mapping:
+            return
+        raws = {key: self.remote.dumps(value) for key, value in mapping.items()}
+        await self.remote.set_many_raw(raws, timeout)
+        local_timeout = self.remote._timeout(timeout)
+        for key, value in mapping.items():
+            self.local.set(key, value, len(raws[key]), timeout=local_timeout)
+        await self._publish(list(mapping))
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.local.pop(key)
+        await self.remote.delete(*keys)
+        await self._publish(list(keys))
+
+    async def add(self, key, value, timeout=None):
+        return await self.remote.add(key, value, timeout=timeout)
+
+    def lock(self, key, timeout=LOCK_TIMEOUT):
+        return self.remote.lock(key, timeout=timeout)
+
+    async def _publish(self, keys):
+        if not self.invalidation or not keys:
+            return
+        message = json.dumps({"sender": self.sender, "cache": self.name, "keys": keys})
+        await self.remote.client.publish(INVALIDATION_CHANNEL, message)
+
+    async def start(self):
+        """Subscribe to invalidations from other workers."""
+        if self.invalidation and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        while True:
+            pubsub = self.remote.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Messages may have been missed while (re)connecting.
+                self.local.clear()
+                async for message in pubsub.listen():
+                    self._invalidate(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Cache invalidation listener error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def _invalidate(self, data):
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if message.get("cache") != self.name or message.get("sender") == self.sender:
+            return
+        for key in message.get("keys", []):
+            self.local.pop(key)
+        incr(f"{self.name}.l1.invalidated", len(message.get("keys", [])))
+
+
+def fresh_key(key):
+    return f"{key}{FRESH_SUFFIX}"
+
+
+class Stale:
+    """A loader result that is already out of date, e.g. a fallback copy.
+
+    It is served and cached like any value but gets no fresh marker, so the
+    next read refreshes it again instead of trusting it for ``soft_timeout``.
+    A background refresh that only finds a stale value counts as failed.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+_refresh_failures = OrderedDict()  # key -> consecutive failed refreshes, oldest first
+_background = set()
+
+
+def refresh_in_background(store, key, refresh):
+    """Run ``refresh()`` for a stale ``key`` without making the caller wait.
+
+    Concurrent refreshes of a key collapse into one, and a Redis ``SET NX``
+    gate lets one worker try per interval, backing off while ``refresh``
+    keeps failing (returning false or raising) so an upstream outage serves
+    stale data instead of piling up requests.
+    """
+
+    async def run():
+        failures = _refresh_failures.get(key, 0)
+        interval = min(REFRESH_INTERVAL * 2 ** min(failures, 16), REFRESH_MAX_BACKOFF)
+        if not await store.add(f"{key}:refresh", True, timeout=interval):
+            incr(f"{store.name}.refresh_throttled")
+            return
+
+        incr(f"{store.name}.refresh")
+        try:
+            ok = await refresh()
+        except Exception as e:
+            print(f"Refreshing {key} failed: {e}")
+            ok = False
+
+        _refresh_failures.pop(key, None)
+        if not ok:
+            _refresh_failures[key] = failures + 1
+            while len(_refresh_failures) > REFRESH_FAILURES_MAX:
+                _refresh_failures.popitem(last=False)
+            incr(f"{store.name}.refresh_failed")
+
+    task = asyncio.ensure_future(flight.do(f"{store.name}:refresh:{key}", run))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _store(store, key, value, timeout, soft_timeout):
+    fresh = not isinstance(value, Stale)
+    if not fresh:
+        value = value.value
+    if callable(timeout):
+        timeout = timeout(value)
+        if timeout is None:
+            return value
+    await store.set(key, value, timeout=timeout)
+    if soft_timeout and fresh:
+        await store.set(fresh_key(key), True, timeout=soft_timeout)
+    return value
+
+
+async def _refresh(store, key, loader, timeout, soft_timeout):
+    # A failed reload keeps the stale value rather than tombstoning it.
+    value = await loader()
+    if value is None or isinstance(value, Stale):
+        return False
+    await _store(store, key, value, timeout, soft_timeout)
+    return True
+
+
+async def cache_aside(
+    store, key, loader, timeout=None, negative_timeout=NEGATIVE_TIMEOUT, soft_timeout=None
+):
+    """Read ``key`` once; on a miss call ``loader`` and store what it returns.
+
+    A ``None`` result is cached as a tombstone for ``negative_timeout``
+    seconds so repeated lookups of a bad key do not reach the upstream.
+    With ``soft_timeout`` the value is served stale after that many seconds
+    and refreshed in the background until ``timeout`` removes it.
+    ``timeout`` may also be a function of the loaded value returning its
+    timeout, or ``None`` to return the value without storing it. A
+    :class:`Stale` result is stored without a fresh marker.
+    """
+    if soft_timeout:
+        value, fresh = await store.get_many([key, fresh_key(key)])
+    else:
+        value, fresh = await store.get(key), True
+
+    if value is NEGATIVE:
+        incr(f"{store.name}.negative")
+        return None
+    if value is not None:
+        incr(f"{store.name}.hit")
+        if not fresh:
+            incr(f"{store.name}.stale")
+            refresh_in_background(
+                store, key, lambda: _refresh(store, key, loader, timeout, soft_timeout)
+            )
+        return value
+
+    incr(f"{store.name}.miss")
+    return await flight.do(
+        f"{store.name}:{key}",
+        lambda: _fill(store, key, loader, timeout, negative_timeout, soft_timeout),
+    )
+
+
+async def _fill(store, key, loader, timeout, negative_timeout, soft_timeout=None):
+    async def fill():
+        value = await loader()
+        if value is None:
+            await store.set(key, NEGATIVE, timeout=negative_timeout)
+        else:
+            value = await _store(store, key, value, timeout, soft_timeout)
+        return value
+
+    value = await locked_fill(store, key, fill, lambda: store.get(key))
+    return None if value is NEGATIVE else value
+
+
+async def locked_fill(store, key, fill, read):
+    """Run ``fill()`` for a missing ``key``, once across workers with ``CACHE_LOCKS``.
+
+    A worker that finds the key's lock taken polls ``read()`` until the
+    holder has stored a value and returns that instead of filling it too.
+    """
+    lock = None
+    if CACHE_LOCKS:
+        lock = store.lock(key)
+        if not await lock.acquire(blocking=False):
+            value = await _wait_for(read, lock)
+            lock = None
+            if value is not None:
+                incr(f"{store.name}.lock_shared")
+                return value
+            # The holder died or is too slow; fill it ourselves.
+
+    try:
+        return await fill()
+    finally:
+        if lock is not None:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+
+
+async def _wait_for(read, lock):
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+        value = await read()
+        if value is not None or not await lock.locked():
+            return value
+    return None
+
+
+async def cache_aside_many(
+    store, keys, loader, timeout=None, negative_timeout=NEGATIVE_TIMEOUT, soft_timeout=None
+):
+    """Batched :func:`cache_aside`.
+
+    ``loader`` receives the list of missing keys and returns a dict of
+    key to value; keys it maps to ``None`` are tombstoned, keys it leaves
+    out (failed lookups) are not cached at all, and :class:`Stale` values
+    are cached without a fresh marker. Returns a dict of every key
+    to its value (``None`` for negatives and failures).
+    Stale keys are refreshed in the background one key per ``loader`` call.
+    """
+    if soft_timeout:
+        raw = await store.get_many([k for key in keys for k in (key, fresh_key(key))])
+        values, markers = raw[0::2], raw[1::2]
+    else:
+        values = await store.get_many(keys)
+        markers = [True] * len(keys)
+
+    results = {}
+    missing = []
+    for key, value, fresh in zip(keys, values, markers):
+        if value is NEGATIVE:
+            incr(f"{store.name}.negative")
+            results[key] = None
+        elif value is not None:
+            incr(f"{store.name}.hit")
+            results[key] = value
+            if not fresh:
+                incr(f"{store.name}.stale")
+                refresh_in_background(
+                    store,
+                    key,
+                    lambda key=key: _refresh(
+                        store, key, lambda: _load_one(loader, key), timeout, soft_timeout
+                    ),
+                )
+        else:
+            incr(f"{store.name}.miss")
+            missing.append(key)
+
+    if missing:
+        loaded = await loader(missing)
+        found = {}
+        negative = {}
+        fresh = []
+        for key in missing:
+            value = loaded.get(key)
+            if isinstance(value, Stale):
+                value = value.value
+            elif value is not None:
+                fresh.append(key)
+            results[key] = value
+            if value is not None:
+                found[key] = value
+            elif key in loaded:
+                negative[key] = NEGATIVE
+
+        await store.set_many(found, timeout=timeout)
+        await store.set_many(negative, timeout=negative_timeout)
+        if soft_timeout:
+            await store.set_many({fresh_key(key): True for key in fresh}, timeout=soft_timeout)
+
+    return {key: results[key] for key in keys}
+
+
+async def _load_one(loader, key):
+    loaded = await loader([key])
+    if key not in loaded:
+        raise LookupError(f"{key} could not be loaded")
+    return loaded[key]
+
+
+# Cache 1: Fast cache (6 minutes timeout)
+cache = RedisCache(
+    "cache",
+    host=os.environ.get("REDIS_HOST", "localhost"),
+    port=int(os.environ.get("REDIS_PORT", "6379")),
+    db=0,
+    default_timeout=360,  # 6 minutes
 )
 
-# Cache 2: Slow cache (24 hours timeout)
-cache_slow = Cache(
-    config={
-        "CACHE_TYPE": "RedisCache",
-        "CACHE_REDIS_HOST": os.environ.get("REDIS_SLOW_HOST", os.environ.get("REDIS_HOST", "localhost")),
-        "CACHE_REDIS_PORT": int(os.environ.get("REDIS_SLOW_PORT", os.environ.get("REDIS_PORT", "6378"))),
-        "CACHE_REDIS_DB": 1,
-        "CACHE_DEFAULT_TIMEOUT": 604800,  # 24 hours
-    }
+# Cache 2: Slow cache (7 days timeout)
+cache_slow = RedisCache(
+    "cache_slow",
+    host=os.environ.get("REDIS_SLOW_HOST", os.environ.get("REDIS_HOST", "localhost")),
+    port=int(os.environ.get("REDIS_SLOW_PORT", os.environ.get("REDIS_PORT", "6378"))),
+    db=1,
+    default_timeout=604800,  # 7 days
 )
+
+# Film metadata: a few thousand popular films serve most lookups, so keep
+# them in process in front of the slow cache.
+film_cache = TieredCache("film_cache", cache_slow)
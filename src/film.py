@@ -1,34 +1,66 @@
 import asyncio
 import json
+import os
 import re
 import time
 
-from bs4 import BeautifulSoup
-from curl_cffi.requests import AsyncSession
-
+from src.cache import Stale, cache_aside, cache_aside_many, film_cache
+from src.governor import UpstreamError
+from src.metrics import incr
+from src.metadata_store import film_slug, metadata_store
+from src.parser import extract_text, parse_html, run_parser
+from src.session import get_session
+from src.singleflight import flight
 from src.utils import fetch_html
 
+# Film details are refreshed in the background once older than the soft
+# timeout and dropped after the hard one.
+FILM_SOFT_TIMEOUT = int(os.environ.get("FILM_SOFT_TIMEOUT", str(7 * 86400)))
+FILM_TIMEOUT = int(os.environ.get("FILM_TIMEOUT", str(30 * 86400)))
+
+# Film pages scraped at once when resolving a batch of cache misses.
+FILM_CONCURRENCY = int(os.environ.get("FILM_CONCURRENCY", "8"))
+
+# Hydrated recommendations carry details for at most this many films and
+# wait at most this long for them; the rest come back with null fields.
+HYDRATE_LIMIT = int(os.environ.get("HYDRATE_LIMIT", "100"))
+HYDRATE_TIMEOUT = float(os.environ.get("HYDRATE_TIMEOUT", "10"))
+
+_pending = set()
+
+
+def normalize_film_id(film_id: str) -> str:
+    """``slug``, ``/film/slug`` or ``/film/slug/...`` -> ``/film/slug/``."""
+    return f"/film/{film_slug(film_id)}/"
 
-def extract_text(element):
-    return element.get_text(strip=True) if element else None
+
+def film_key(film_id: str) -> str:
+    return f"film:{normalize_film_id(film_id)}"
+
+
+FILM_FIELDS = (
+    "id",
+    "name",
+    "year",
+    "director",
+    "tagline",
+    "synopsis",
+    "poster",
+    "casts",
+    "genres",
+    "themes",
+    "duration",
+    "rating",
+)
+
+# Fields attached to hydrated recommendations unless others are asked for.
+HYDRATE_FIELDS = ("name", "year", "poster")
 
 
 def parse_film_data(html, film_id):
-    soup = BeautifulSoup(html, "html.parser")
-    data = {
-        "id": film_id,
-        "name": None,
-        "year": None,
-        "director": None,
-        "tagline": None,
-        "synopsis": None,
-        "poster": None,
-        "casts": None,
-        "genres": None,
-        "themes": None,
-        "duration": None,
-        "rating": None,
-    }
+    soup = parse_html(html)
+    data = dict.fromkeys(FILM_FIELDS)
+    data["id"] = film_id
 
     details_head = soup.select_one(".details")
     if details_head:
@@ -41,24 +73,24 @@ def parse_film_data(html, film_id):
 
     cast_links = soup.select(".cast-list .text-slug")
     if cast_links:
-        casts = [c.get_text(strip=True) for c in cast_links]
+        casts = [c.text(strip=True) for c in cast_links]
         data["casts"] = ", ".join(casts)
 
     genre_lists = soup.select("#tab-genres .text-sluglist")
 
     if len(genre_lists) > 0:
         g_links = genre_lists[0].select("a")
-        data["genres"] = ", ".join([l.get_text(strip=True) for l in g_links])
+        data["genres"] = ", ".join([l.text(strip=True) for l in g_links])
 
     if len(genre_lists) > 1:
         t_links = genre_lists[1].select("a")
-        data["themes"] = ", ".join([l.get_text(strip=True) for l in t_links])
+        data["themes"] = ", ".join([l.text(strip=True) for l in t_links])
 
     if not data["poster"]:
         try:
-            script_tag = soup.find("script", type="application/ld+json")
+            script_tag = soup.select_one('script[type="application/ld+json"]')
             if script_tag:
-                json_content = script_tag.string.replace("/* <![CDATA[ */", "").replace(
+                json_content = script_tag.text(strip=False).replace("/* <![CDATA[ */", "").replace(
                     "/* ]]> */", ""
                 )
                 ld_data = json.loads(json_content)
@@ -75,7 +107,7 @@ def parse_film_data(html, film_id):
     try:
         dur_el = soup.select_one(".text-footer")
         if dur_el:
-            dur_text = dur_el.get_text(strip=True)
+            dur_text = dur_el.text(strip=True)
             match = re.search(r"(\d+)\s+mins", dur_text)
             if match:
                 data["duration"] = match.group(1)
@@ -98,10 +130,147 @@ async def get_film_by_id(film_id):
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     }
 
-    async with AsyncSession(impersonate="chrome") as session:
-        html = await fetch_html(session, url)
-        if not html:
-            return None
+    html = await fetch_html(get_session(), url)
+    if not html:
+        return None
+
+    data = await run_parser(parse_film_data, html, film_id)
+    return data
+
+
+async def scrape_films(film_ids):
+    """Scrape ``film_ids`` (normalised), ``FILM_CONCURRENCY`` at a time.
+
+    Returns details, or ``None`` for films that do not exist, for every
+    film the upstream answered; films it failed on are left out. Found
+    details are recorded in the metadata store.
+    """
+    semaphore = asyncio.Semaphore(FILM_CONCURRENCY)
+
+    async def fetch(film_id):
+        async with semaphore:
+            return await get_film_by_id(film_id)
+
+    fetched = await asyncio.gather(
+        *[flight.do(film_key(film_id), lambda film_id=film_id: fetch(film_id)) for film_id in film_ids],
+        return_exceptions=True,
+    )
+    scraped = {
+        film_id: data
+        for film_id, data in zip(film_ids, fetched)
+        if not isinstance(data, Exception)
+    }
+    await metadata_store.put_many(
+        {film_slug(film_id): data for film_id, data in scraped.items() if data is not None}
+    )
+    return scraped
+
+
+async def load_films(film_ids):
+    """Details for normalised ``film_ids`` from the metadata store or a scrape.
+
+    Stored details younger than ``FILM_SOFT_TIMEOUT`` are used as is; older
+    ones are re-scraped and only served, wrapped in :class:`Stale`, if the
+    scrape fails. Films that could not be fetched and were never stored are
+    left out.
+    """
+    stored = await metadata_store.get_many([film_slug(film_id) for film_id in film_ids])
+    now = time.time()
+
+    results = {}
+    stale = {}
+    for film_id in film_ids:
+        data, fetched_at = stored.get(film_slug(film_id), (None, 0))
+        if data is not None and now - fetched_at < FILM_SOFT_TIMEOUT:
+            results[film_id] = data
+        elif data is not None:
+            stale[film_id] = data
+
+    missing = [film_id for film_id in film_ids if film_id not in results]
+    incr("film_store.hit", len(results))
+    incr("film_store.miss", len(missing))
+    if missing:
+        scraped = await scrape_films(missing)
+        for film_id in missing:
+            if film_id in scraped:
+                results[film_id] = scraped[film_id]
+            elif film_id in stale:
+                incr("film_store.stale_fallback")
+                results[film_id] = Stale(stale[film_id])
+    return results
+
+
+async def get_film(film_id: str):
+    """Details for one film, ``None`` if it cannot be scraped.
+
+    Looked up in the in-process cache, Redis and the metadata store before
+    scraping the film page.
+    """
+    film_id = normalize_film_id(film_id)
+
+    async def load():
+        loaded = await load_films([film_id])
+        if film_id not in loaded:
+            raise UpstreamError(f"https://letterboxd.com{film_id}")
+        return loaded[film_id]
+
+    return await cache_aside(
+        film_cache, film_key(film_id), load, timeout=FILM_TIMEOUT, soft_timeout=FILM_SOFT_TIMEOUT
+    )
+
+
+async def get_films(film_ids):
+    """Details for many films, keyed by the ids as given.
+
+    All cache entries are read in one batch; the misses are read from the
+    metadata store in one query, only what is still missing is scraped,
+    and everything found is written back to the cache together.
+    """
+    keys = {film_key(film_id): normalize_film_id(film_id) for film_id in film_ids}
+
+    async def load(missing):
+        loaded = await load_films([keys[key] for key in missing])
+        return {key: loaded[keys[key]] for key in missing if keys[key] in loaded}
+
+    details = await cache_aside_many(
+        film_cache, list(keys), load, timeout=FILM_TIMEOUT, soft_timeout=FILM_SOFT_TIMEOUT
+    )
+    return {film_id: details[film_key(film_id)] for film_id in film_ids}
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background film fill failed: {task.exception()!r}")
+
+
+async def get_films_within(film_ids, timeout, metric="film.fill_timeout"):
+    """:func:`get_films`, or ``{}`` if that takes longer than ``timeout`` seconds.
+
+    A fill that runs over is left to finish in the background so the film
+    cache is warm for the next request.
+    """
+    if not film_ids:
+        return {}
+    task = asyncio.ensure_future(get_films(film_ids))
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if task in done:
+        return task.result()
+
+    incr(metric)
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+    task.add_done_callback(_log_failure)
+    return {}
+
+
+async def hydrate_films(film_ids, fields=HYDRATE_FIELDS):
+    """``film_ids`` in order, each with only ``fields`` of its details.
 
-        data = parse_film_data(html, film_id)
-        return data
+    Only the first ``HYDRATE_LIMIT`` films are looked up, within
+    ``HYDRATE_TIMEOUT`` seconds; films without details get null fields.
+    """
+    details = await get_films_within(film_ids[:HYDRATE_LIMIT], HYDRATE_TIMEOUT, "film.hydrate_timeout")
+    return [
+        {"film_id": film_id, **{field: (details.get(film_id) or {}).get(field) for field in fields}}
+        for film_id in film_ids
+    ]
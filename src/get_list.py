@@ -1,10 +1,16 @@
 import asyncio
+import math
+import os
+from urllib.parse import urlparse
 
-from bs4 import BeautifulSoup
 from curl_cffi.requests import AsyncSession
 
+from src.parser import parse_html, parse_last_page, run_parser
+from src.session import get_session
 from src.utils import fetch_html
 
+LIST_CONCURRENCY = int(os.environ.get("LIST_CONCURRENCY", "4"))
+
 
 def parse_list_entries(html: str):
     """Parse film list entries from HTML.
@@ -13,13 +19,22 @@ def parse_list_entries(html: str):
     - Numbered poster lists: ul.js-list-entries > li.posteritem
     - Grid layouts: ul.grid > li.griditem
     """
-    soup = BeautifulSoup(html, "html.parser")
-    
+    return list_entries(parse_html(html))
+
+
+def parse_list_page(html: str):
+    soup = parse_html(html)
+    return {"entries": list_entries(soup), "last_page": parse_last_page(soup)}
+
+
+def list_entries(soup):
+    films = []
+
     entries = soup.select("ul.js-list-entries > li.posteritem")
-    
+
     if not entries:
         entries = soup.select("ul.grid > li.griditem")
-    
+
     for entry in entries:
         react_component = entry.select_one("div.react-component")
         if not react_component:
@@ -29,10 +44,19 @@ def parse_list_entries(html: str):
         title = react_component.get("data-item-name")
         
         if film_id and title:
-            yield {
+            films.append({
                 "title": title.strip(),
                 "film_id": film_id,
-            }
+            })
+
+    return films
+
+
+def normalize_list_id(list_id: str) -> str:
+    """Turn a list URL or path into "/user/list/name" form."""
+    if "://" in list_id:
+        list_id = urlparse(list_id).path
+    return "/" + list_id.strip("/")
 
 
 async def fetch_list_page(session: AsyncSession, list_id: str, page: int):
@@ -41,51 +65,96 @@ async def fetch_list_page(session: AsyncSession, list_id: str, page: int):
     html = await fetch_html(session, url)
     if not html:
         return []
-    
-    return list(parse_list_entries(html))
+
+    return await run_parser(parse_list_entries, html)
+
+
+async def fetch_list_page_info(session: AsyncSession, list_id: str, page: int):
+    """Fetch a page of a film list along with the paginator's last page."""
+    url = f"https://letterboxd.com{list_id}/page/{page}/"
+    html = await fetch_html(session, url)
+    if not html:
+        return [], None
+
+    parsed = await run_parser(parse_list_page, html)
+    return parsed["entries"], parsed["last_page"]
+
+
+async def iter_list_pages(list_id: str, page: int = None, limit: int = None):
+    """Yield the pages of a list in order as lists of entries.
+
+    The page count is read from page 1 and the remaining pages are fetched
+    concurrently, at most ``LIST_CONCURRENCY`` at a time. Nothing beyond
+    what ``limit`` needs is requested.
+    """
+    list_id = normalize_list_id(list_id)
+    session = get_session()
+
+    # Fetch single page if specified
+    if page:
+        yield await fetch_list_page(session, list_id, page)
+        return
+
+    first, last_page = await fetch_list_page_info(session, list_id, 1)
+    yield first
+    if not first or (limit and len(first) >= limit):
+        return
+
+    if last_page is None:
+        # No paginator in the markup: walk pages until an empty one.
+        current_page = 2
+        fetched = len(first)
+        while not limit or fetched < limit:
+            entries = await fetch_list_page(session, list_id, current_page)
+            if not entries:
+                break
+            yield entries
+            fetched += len(entries)
+            current_page += 1
+        return
+
+    if limit:
+        last_page = min(last_page, math.ceil(limit / len(first)))
+
+    semaphore = asyncio.Semaphore(LIST_CONCURRENCY)
+
+    async def fetch(p):
+        async with semaphore:
+            return await fetch_list_page(session, list_id, p)
+
+    tasks = [asyncio.ensure_future(fetch(p)) for p in range(2, last_page + 1)]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def iter_list(list_id: str, page: int = None, limit: int = None):
+    """Yield list entries one at a time, stopping as soon as ``limit`` is met."""
+    count = 0
+    pages = iter_list_pages(list_id, page=page, limit=limit)
+    try:
+        async for entries in pages:
+            for entry in entries:
+                yield entry
+                count += 1
+                if limit and count >= limit:
+                    return
+    finally:
+        await pages.aclose()
 
 
 async def get_list(list_id: str, page: int = None, limit: int = None):
     """Fetch films from a Letterboxd list.
-    
+
     Args:
-        list_id: The list URL path (e.g., "/user/list/top-10/")
+        list_id: The list URL or path (e.g., "/user/list/top-10/")
         page: Specific page number to fetch. If None, fetches all pages.
         limit: Maximum number of films to return. If None, returns all.
-    
+
     Returns:
         List of film dictionaries with 'title' and 'film_id'.
     """
-    # Normalize list_id
-    if not list_id.startswith("/"):
-        list_id = f"/{list_id}"
-    
-    results = []
-    current_page = page if page else 1
-    
-    async with AsyncSession(impersonate="chrome") as session:
-        # Fetch single page if specified
-        if page:
-            results = await fetch_list_page(session, list_id, page)
-            if limit:
-                results = results[:limit]
-            return results
-        
-        # Fetch all pages
-        while True:
-            if limit and len(results) >= limit:
-                break
-            
-            entries = await fetch_list_page(session, list_id, current_page)
-            
-            if not entries:
-                break
-            
-            results.extend(entries)
-            current_page += 1
-    
-    # Apply limit if specified
-    if limit:
-        results = results[:limit]
-    
-    return results
+    return [entry async for entry in iter_list(list_id, page=page, limit=limit)]
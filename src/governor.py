@@ -0,0 +1,197 @@
+"""Central rate limiting and retries for upstream (Letterboxd) requests.
+
+Every fetch takes a token from a global bucket and from its host's bucket
+and holds one of ``UPSTREAM_CONCURRENCY`` slots while in flight. Host rates
+adapt AIMD-style: each success adds ``UPSTREAM_RATE_STEP`` requests/s up to
+the configured rate, each 429/403/5xx halves it. Failed attempts are
+retried with jittered exponential backoff, waiting at least as long as a
+``Retry-After`` header asks.
+
+A 404 is an answer (``None``); anything else that does not end in a 200
+raises :class:`UpstreamError` so callers never mistake a failure for an
+empty page.
+"""
+
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from src.metrics import incr, observe
+
+UPSTREAM_CONCURRENCY = int(os.environ.get("UPSTREAM_CONCURRENCY", "16"))
+UPSTREAM_RATE = float(os.environ.get("UPSTREAM_RATE", "20"))  # requests/s, all hosts
+UPSTREAM_HOST_RATE = float(os.environ.get("UPSTREAM_HOST_RATE", "10"))  # requests/s per host
+UPSTREAM_MIN_RATE = float(os.environ.get("UPSTREAM_MIN_RATE", "0.5"))
+UPSTREAM_RATE_STEP = float(os.environ.get("UPSTREAM_RATE_STEP", "0.2"))
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", "3"))
+UPSTREAM_BACKOFF = float(os.environ.get("UPSTREAM_BACKOFF", "0.5"))
+UPSTREAM_MAX_BACKOFF = float(os.environ.get("UPSTREAM_MAX_BACKOFF", "30"))
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "30"))
+
+# Statuses that mean "slow down" rather than "this page is broken".
+THROTTLE_STATUSES = {403, 429, 503}
+
+
+class UpstreamError(Exception):
+    """The upstream could not be reached or kept failing; nothing to cache."""
+
+    def __init__(self, url, status=None, retry_after=None):
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+        super().__init__(f"{url}: {status or 'request failed'}")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        """Hand out no tokens for ``seconds`` (a ``Retry-After``)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def blocked_for(self) -> float:
+        return max(0.0, self.blocked_until - time.monotonic())
+
+
+def retry_after(response):
+    """Seconds asked for by a ``Retry-After`` header, if any."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Governor:
+    def __init__(
+        self,
+        concurrency=UPSTREAM_CONCURRENCY,
+        rate=UPSTREAM_RATE,
+        host_rate=UPSTREAM_HOST_RATE,
+        retries=UPSTREAM_RETRIES,
+    ):
+        self.concurrency = concurrency
+        self.host_rate = host_rate
+        self.retries = retries
+        self.bucket = TokenBucket(rate)
+        self.hosts: dict[str, TokenBucket] = {}
+        self._semaphore = None
+        self._loop = None
+
+    def _slots(self):
+        # asyncio primitives belong to one loop; rebuild them if it changed
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self.bucket = TokenBucket(self.bucket.rate, self.bucket.burst)
+            self.hosts = {}
+        return self._semaphore
+
+    def _host(self, host):
+        bucket = self.hosts.get(host)
+        if bucket is None:
+            bucket = self.hosts[host] = TokenBucket(self.host_rate)
+        return bucket
+
+    def _success(self, bucket):
+        bucket.rate = min(self.host_rate, bucket.rate + UPSTREAM_RATE_STEP)
+
+    def _throttled(self, bucket, wait):
+        bucket.rate = max(UPSTREAM_MIN_RATE, bucket.rate / 2)
+        if wait:
+            bucket.block(wait)
+
+    def _backoff(self, attempt, wait=None):
+        delay = random.uniform(0, min(UPSTREAM_MAX_BACKOFF, UPSTREAM_BACKOFF * 2**attempt))
+        return max(delay, wait or 0)
+
+    async def fetch(self, session, url):
+        """Body of ``url`` on a 200, ``None`` on a 404, else :class:`UpstreamError`."""
+        host = urlparse(url).netloc
+        semaphore = self._slots()
+        bucket = self._host(host)
+        status = wait = None
+
+        for attempt in range(self.retries + 1):
+            if bucket.blocked_for() > UPSTREAM_MAX_BACKOFF:
+                # Told to stay away for long; fail now instead of queueing.
+                wait = bucket.blocked_for()
+                break
+            if attempt:
+                incr("upstream.retry")
+                await asyncio.sleep(self._backoff(attempt - 1, wait))
+
+            await self.bucket.acquire()
+            await bucket.acquire()
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await session.get(url, timeout=UPSTREAM_TIMEOUT)
+                except Exception as e:
+                    incr("upstream.error")
+                    print(f"Error fetching {url}: {e}")
+                    status = wait = None
+                    continue
+                finally:
+                    observe("upstream.latency", time.perf_counter() - start)
+
+            status = response.status_code
+            if status == 200:
+                incr("upstream.ok")
+                self._success(bucket)
+                return response.text
+            if status == 404:
+                incr("upstream.not_found")
+                self._success(bucket)
+                return None
+
+            wait = retry_after(response)
+            if status in THROTTLE_STATUSES:
+                incr("upstream.throttled")
+                self._throttled(bucket, wait)
+            elif status >= 500:
+                incr("upstream.server_error")
+                self._throttled(bucket, wait)
+            else:
+                incr(f"upstream.status_{status}")
+                break
+            print(f"{url} returned {status}, attempt {attempt + 1}/{self.retries + 1}")
+
+        incr("upstream.gave_up")
+        raise UpstreamError(url, status, wait)
+
+
+governor = Governor()
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import time
+
+from src.cache import cache_slow
+from src.metrics import incr, observe
+from src.session import get_session
+from src.users import get_user_diary_page_info
+
+# Films per /films/ page; a shorter page is the last one.
+DIARY_PAGE_SIZE = 72
+DIARY_CONCURRENCY = int(os.environ.get("DIARY_CONCURRENCY", "4"))
+
+# A full re-scrape still happens this often to pick up edited ratings and
+# removed films; in between only the leading diary pages are fetched.
+FULL_SYNC_INTERVAL = int(os.environ.get("DIARY_FULL_SYNC_INTERVAL", "86400"))
+STORE_TIMEOUT = int(os.environ.get("DIARY_STORE_TIMEOUT", str(30 * 86400)))
+
+
+def interactions_key(user_id: str) -> str:
+    return f"interactions:{user_id}"
+
+
+def compact(data):
+    return [
+        (r["film_id"], r.get("rating") or 0.0, bool(r.get("liked")))
+        for r in data
+        if r.get("film_id")
+    ]
+
+
+async def fetch_all_pages(session, user_id: str):
+    """Fetch the whole diary, reading the real page range from page 1.
+
+    Returns ``(entries, pages_fetched)``.
+    """
+    # Page lengths are judged by raw grid items: entries can be skipped
+    # while parsing, and a full page with a skipped row is not the last one.
+    first, last_page, rows = await get_user_diary_page_info(session, user_id, 1)
+    if not last_page and rows < DIARY_PAGE_SIZE:
+        return compact(first), 1
+
+    semaphore = asyncio.Semaphore(DIARY_CONCURRENCY)
+
+    async def fetch(page):
+        async with semaphore:
+            return await get_user_diary_page_info(session, user_id, page)
+
+    pages = [first]
+    if last_page:
+        rest = await asyncio.gather(*[fetch(p) for p in range(2, last_page + 1)])
+        pages += [data for data, _, _ in rest]
+        fetched = last_page
+    else:
+        fetched = 1
+        # No paginator in the markup: probe a window at a time until a short page.
+        page = 2
+        while rows >= DIARY_PAGE_SIZE:
+            window = range(page, page + DIARY_CONCURRENCY)
+            fetched += len(window)
+            for data, _, rows in await asyncio.gather(*[fetch(p) for p in window]):
+                pages.append(data)
+                if rows < DIARY_PAGE_SIZE:
+                    break
+            page += DIARY_CONCURRENCY
+
+    entries = []
+    for data in pages:
+        entries.extend(compact(data))
+    return entries, fetched
+
+
+async def fetch_new_pages(session, user_id: str, known: set):
+    """Fetch leading diary pages until one contains an already stored film."""
+    entries = []
+    page = 1
+    while True:
+        data, _, rows = await get_user_diary_page_info(session, user_id, page)
+        if not rows:
+            break
+
+        new = compact(data)
+        entries.extend(new)
+        if rows < DIARY_PAGE_SIZE or any(film_id in known for film_id, _, _ in new):
+            break
+        page += 1
+
+    return entries, page
+
+
+def merge(new_entries, stored_entries):
+    """Entries from the fresh leading pages win over stored ones."""
+    fresh = {film_id for film_id, _, _ in new_entries}
+    return new_entries + [e for e in stored_entries if e[0] not in fresh]
+
+
+async def sync_interactions(user_id: str):
+    """Return a user's diary as ``(film_id, rating, liked)`` tuples, newest first.
+
+    The result is persisted with the time of the last full sync; until
+    ``FULL_SYNC_INTERVAL`` has passed, later calls only walk the leading
+    pages until they reach a film already stored.
+    """
+    key = interactions_key(user_id)
+    stored = await cache_slow.get(key)
+    session = get_session()
+    now = time.time()
+
+    if stored and now - stored["full_sync_at"] < FULL_SYNC_INTERVAL:
+        known = {film_id for film_id, _, _ in stored["entries"]}
+        new_entries, pages_fetched = await fetch_new_pages(session, user_id, known)
+        entries = merge(new_entries, stored["entries"])
+        full_sync_at = stored["full_sync_at"]
+        incr("diary.incremental_sync")
+    else:
+        entries, pages_fetched = await fetch_all_pages(session, user_id)
+        full_sync_at = now
+        incr("diary.full_sync")
+
+    incr("diary.pages_fetched", pages_fetched)
+    observe("diary.pages_per_sync", pages_fetched)
+
+    if entries:
+        await cache_slow.set(
+            key,
+            {"entries": entries, "full_sync_at": full_sync_at},
+            timeout=STORE_TIMEOUT,
+        )
+    return entries
@@ -0,0 +1,100 @@
+"""Persistent film metadata keyed by slug.
+
+Film details scraped once are kept in a local SQLite file so they survive
+Redis eviction and restarts. Fill it for the whole model catalogue with::
+
+    python -m src.warmup
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+METADATA_DB = os.path.join(DATA_DIR, "films.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS films (
+    slug TEXT PRIMARY KEY,
+    data TEXT NOT NULL,  -- JSON film details
+    fetched_at REAL NOT NULL
+)
+"""
+
+# SQLite limits the number of bound parameters per statement.
+QUERY_CHUNK = 500
+
+
+def film_slug(film_id: str) -> str:
+    """``/film/slug/`` -> ``slug``."""
+    slug = film_id.strip("/")
+    if slug.startswith("film/"):
+        slug = slug[len("film/"):]
+    return slug.split("/")[0]
+
+
+class MetadataStore:
+    """SQLite table of film details. Blocking calls run in a thread."""
+
+    def __init__(self, path=METADATA_DB):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL lets every worker read while one of them writes.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _get_many(self, slugs):
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(slugs), QUERY_CHUNK):
+                chunk = slugs[start:start + QUERY_CHUNK]
+                rows = conn.execute(
+                    f"SELECT slug, data, fetched_at FROM films WHERE slug IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                found.update((slug, (data, fetched_at)) for slug, data, fetched_at in rows)
+        return found
+
+    def _put_many(self, mapping):
+        now = time.time()
+        rows = [(slug, json.dumps(data), now) for slug, data in mapping.items()]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO films (slug, data, fetched_at) VALUES (?, ?, ?)", rows
+                )
+
+    async def get_many(self, slugs):
+        """``slug -> (details, fetched_at)`` for the stored ``slugs``."""
+        if not slugs:
+            return {}
+        found = await asyncio.to_thread(self._get_many, list(slugs))
+        return {slug: (json.loads(data), fetched_at) for slug, (data, fetched_at) in found.items()}
+
+    async def put_many(self, mapping):
+        """Store ``slug -> details``."""
+        if mapping:
+            await asyncio.to_thread(self._put_many, mapping)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+metadata_store = MetadataStore()
@@ -0,0 +1,27 @@
+from collections import Counter
+
+counters = Counter()
+observations = {}
+
+
+def incr(name: str, value: int = 1):
+    counters[name] += value
+
+
+def observe(name: str, value: float):
+    stats = observations.setdefault(name, {"count": 0, "sum": 0, "max": 0})
+    stats["count"] += 1
+    stats["sum"] += value
+    stats["max"] = max(stats["max"], value)
+
+
+def snapshot():
+    data = dict(sorted(counters.items()))
+    for name in list(data):
+        if name.endswith(".hit"):
+            prefix = name[: -len(".hit")]
+            lookups = data[name] + data.get(f"{prefix}.miss", 0)
+            data[f"{prefix}.hit_ratio"] = data[name] / lookups
+    for name, stats in sorted(observations.items()):
+        data[name] = {**stats, "avg": stats["sum"] / stats["count"]}
+    return data
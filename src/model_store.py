@@ -0,0 +1,160 @@
+"""Pickle-free storage for the recommender model.
+
+Export the trained pickle once::
+
+    python -m src.model_store model/model.pkl model/
+
+The factor matrices are written as ``.npy`` files and memory-mapped on load,
+so every worker shares the same pages through the OS page cache and starts
+without unpickling anything. Film and user ids are stored as fixed-width
+string arrays in index order plus an argsort, which is enough to look ids
+up with ``searchsorted`` without building a dict.
+"""
+
+import json
+import os
+import sys
+from collections.abc import Mapping
+
+import numpy as np
+from implicit.cpu.als import AlternatingLeastSquares
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "model")
+META_FILE = "meta.json"
+
+
+class IdMap(Mapping):
+    """Read-only ``id -> index`` mapping backed by sorted numpy arrays."""
+
+    def __init__(self, ids: np.ndarray, order: np.ndarray):
+        self.ids = ids  # ids[index] -> id
+        self.order = order  # argsort of ids
+
+    @classmethod
+    def from_dict(cls, id_map: dict, size: int):
+        ids = _ids_array(id_map, size)
+        return cls(ids, np.argsort(ids).astype(np.int32))
+
+    def resolve(self, keys):
+        """Vectorized lookup: ``(indices, found)`` for an array of ids.
+
+        ``indices`` is only meaningful where ``found`` is true.
+        """
+        keys = np.asarray(keys, dtype=str)
+        if not len(self.ids) or not len(keys):
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        pos = np.searchsorted(self.ids, keys, sorter=self.order)
+        indices = self.order[np.minimum(pos, len(self.order) - 1)].astype(np.int64)
+        found = self.ids[indices] == keys
+        return indices, found
+
+    def _find(self, key):
+        pos = np.searchsorted(self.ids, key, sorter=self.order)
+        if pos < len(self.order):
+            index = self.order[pos]
+            if self.ids[index] == key:
+                return int(index)
+        return None
+
+    def __getitem__(self, key):
+        index = self._find(key)
+        if index is None:
+            raise KeyError(key)
+        return index
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        return (str(i) for i in self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _ids_array(id_map: dict, size: int) -> np.ndarray:
+    ids = np.empty(size, dtype=object)
+    for key, index in id_map.items():
+        ids[index] = key
+    if any(i is None for i in ids):
+        raise ValueError("id map does not cover every factor row")
+    return ids.astype(str)
+
+
+def export_model(pickle_path: str, out_dir: str = MODEL_DIR):
+    import pickle
+
+    with open(pickle_path, "rb") as f:
+        obj = pickle.load(f)
+
+    model = obj["model"]
+    os.makedirs(out_dir, exist_ok=True)
+
+    item_factors = np.ascontiguousarray(model.item_factors)
+    user_factors = np.ascontiguousarray(model.user_factors)
+    item_ids = _ids_array(obj["item_map"], item_factors.shape[0])
+    user_ids = _ids_array(obj["user_map"], user_factors.shape[0])
+
+    np.save(os.path.join(out_dir, "item_factors.npy"), item_factors)
+    np.save(os.path.join(out_dir, "user_factors.npy"), user_factors)
+    np.save(os.path.join(out_dir, "item_ids.npy"), item_ids)
+    np.save(os.path.join(out_dir, "item_order.npy"), np.argsort(item_ids).astype(np.int32))
+    np.save(os.path.join(out_dir, "user_ids.npy"), user_ids)
+    np.save(os.path.join(out_dir, "user_order.npy"), np.argsort(user_ids).astype(np.int32))
+
+    meta = {
+        "factors": int(model.factors),
+        "regularization": float(model.regularization),
+        "alpha": float(model.alpha),
+        "dtype": np.dtype(model.dtype).name,
+    }
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+
+def has_artifact(model_dir: str = MODEL_DIR) -> bool:
+    return os.path.exists(os.path.join(model_dir, META_FILE))
+
+
+def load_item_ids(model_dir: str = MODEL_DIR) -> np.ndarray:
+    """Film ids of the model in index order, without loading the factors."""
+    if has_artifact(model_dir):
+        return np.load(os.path.join(model_dir, "item_ids.npy"), mmap_mode="r")
+
+    import pickle
+
+    with open(os.path.join(model_dir, "model.pkl"), "rb") as f:
+        obj = pickle.load(f)
+    return _ids_array(obj["item_map"], obj["model"].item_factors.shape[0])
+
+
+def load_model(model_dir: str = MODEL_DIR):
+    """Return ``(model, item_map, user_map)`` from an exported model directory."""
+
+    def load(name, mode="r"):
+        return np.load(os.path.join(model_dir, f"{name}.npy"), mmap_mode=mode)
+
+    with open(os.path.join(model_dir, META_FILE)) as f:
+        meta = json.load(f)
+
+    model = AlternatingLeastSquares(
+        factors=meta["factors"],
+        regularization=meta["regularization"],
+        alpha=meta["alpha"],
+        dtype=meta["dtype"],
+    )
+    # implicit's Cython kernels reject read-only buffers; copy-on-write maps
+    # are writable but still share clean pages with every other worker.
+    model.item_factors = load("item_factors", "c")
+    model.user_factors = load("user_factors", "c")
+
+    item_map = IdMap(load("item_ids"), load("item_order"))
+    user_map = IdMap(load("user_ids"), load("user_order"))
+    return model, item_map, user_map
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m src.model_store <model.pkl> [out_dir]")
+        sys.exit(1)
+    export_model(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else MODEL_DIR)
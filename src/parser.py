@@ -0,0 +1,137 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from bs4 import BeautifulSoup
+
+from src.governor import UpstreamError
+from src.metrics import incr
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # pragma: no cover - selectolax is optional
+    LexborHTMLParser = None
+
+# "lexbor" (selectolax) is the fast path, "bs4" the BeautifulSoup fallback.
+HTML_PARSER = os.environ.get("HTML_PARSER", "lexbor")
+
+# Where extractors run: "thread", "process" or "inline" (on the event loop).
+PARSE_EXECUTOR = os.environ.get("PARSE_EXECUTOR", "thread")
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "4"))
+# Pages larger than this are dropped instead of tying up a parse worker.
+PARSE_MAX_BYTES = int(os.environ.get("PARSE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+
+class PageTooLarge(UpstreamError):
+    """A fetched page over ``PARSE_MAX_BYTES``, left unparsed.
+
+    An :class:`UpstreamError` so nothing built from the rest of the pages
+    is cached as if it were complete.
+    """
+
+    def __init__(self, fn, size):
+        super().__init__(fn.__name__, status=None)
+        self.size = size
+        self.args = (f"{fn.__name__}: page of {size} bytes is over PARSE_MAX_BYTES",)
+
+
+class LexborNode:
+    __slots__ = ("node",)
+
+    def __init__(self, node):
+        self.node = node
+
+    def select_one(self, selector):
+        node = self.node.css_first(selector)
+        return LexborNode(node) if node is not None else None
+
+    def select(self, selector):
+        return [LexborNode(node) for node in self.node.css(selector)]
+
+    def get(self, attr):
+        return self.node.attributes.get(attr)
+
+    def text(self, strip=True):
+        return self.node.text(strip=strip)
+
+
+class SoupNode:
+    __slots__ = ("node",)
+
+    def __init__(self, node):
+        self.node = node
+
+    def select_one(self, selector):
+        node = self.node.select_one(selector)
+        return SoupNode(node) if node is not None else None
+
+    def select(self, selector):
+        return [SoupNode(node) for node in self.node.select(selector)]
+
+    def get(self, attr):
+        value = self.node.get(attr)
+        # multi-valued attributes such as class come back as lists
+        return " ".join(value) if isinstance(value, list) else value
+
+    def text(self, strip=True):
+        return self.node.get_text(strip=strip)
+
+
+def parse_html(html: str, backend: str = None):
+    """Parse ``html`` into a node exposing select_one/select/get/text.
+
+    Extractors are written against this small interface so the backend can
+    be switched with ``HTML_PARSER`` without touching them.
+    """
+    backend = backend or HTML_PARSER
+    if backend == "lexbor" and LexborHTMLParser is not None:
+        return LexborNode(LexborHTMLParser(html))
+    return SoupNode(BeautifulSoup(html, "html.parser"))
+
+
+def extract_text(element):
+    return element.text(strip=True) if element else None
+
+
+def parse_last_page(soup):
+    """Highest page number in a Letterboxd paginator, or None without one."""
+    pages = [a.text(strip=True) for a in soup.select(".paginate-pages li a")]
+    numbers = [int(p) for p in pages if p.isdigit()]
+    return max(numbers) if numbers else None
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None and PARSE_EXECUTOR != "inline":
+        if PARSE_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_parser(fn, html: str, *args):
+    """Run extractor ``fn(html, *args)`` off the event loop.
+
+    Extractors must be module-level functions returning plain dicts/lists so
+    their results can cross a process boundary. Raises
+    :class:`PageTooLarge` for pages over ``PARSE_MAX_BYTES``.
+    """
+    if len(html) > PARSE_MAX_BYTES:
+        incr("parse.oversized")
+        raise PageTooLarge(fn, len(html))
+
+    executor = get_executor()
+    if executor is None:
+        return fn(html, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, html, *args)
@@ -1,21 +1,55 @@
 import asyncio
+import hashlib
+import os
 import pickle
 
 import numpy as np
-from curl_cffi.requests import AsyncSession
 from scipy.sparse import coo_matrix, csr_matrix
 
-from src.users import get_user_diary_page
-from src.cache import cache
+from src.cache import cache, fresh_key, locked_fill, refresh_in_background
+from src.ann import IVF_NPROBE, load_or_build
+from src.governor import UpstreamError
+from src.interactions import sync_interactions
+from src.metrics import incr
+from src.model_store import MODEL_DIR, IdMap, has_artifact, load_model
+from src.singleflight import flight
+from src.solver import UserSolver
 
+# "exact" scores every item; "ivf" ranks with the approximate IVF index.
+RECOMMEND_INDEX = os.environ.get("RECOMMEND_INDEX", "exact")
 
-with open("model/model.pkl", "rb") as f:
-    obj = pickle.load(f)
 
-model = obj["model"]
-item_map = obj["item_map"]
-user_map = obj["user_map"]
-id_to_film = {idx: film_id for film_id, idx in item_map.items()}
+if has_artifact(MODEL_DIR):
+    model, item_map, user_map = load_model(MODEL_DIR)
+    id_to_film = item_map.ids
+else:
+    # Legacy pickle; export it with `python -m src.model_store` to skip this.
+    print("Loading model/model.pkl; export it with `python -m src.model_store model/model.pkl model/`")
+    with open(os.path.join(MODEL_DIR, "model.pkl"), "rb") as f:
+        obj = pickle.load(f)
+
+    model = obj["model"]
+    item_map = IdMap.from_dict(obj["item_map"], model.item_factors.shape[0])
+    user_map = IdMap.from_dict(obj["user_map"], model.user_factors.shape[0])
+    id_to_film = item_map.ids
+
+# Ranked lists are cached as item indices, which are only meaningful for the
+# model that produced them.
+MODEL_VERSION = hashlib.sha1(np.ascontiguousarray(id_to_film).tobytes()).hexdigest()[:12]
+
+solver = UserSolver(model.item_factors, model.regularization, model.alpha)
+
+ann_index = None
+if RECOMMEND_INDEX == "ivf":
+    ann_index = load_or_build(np.asarray(model.item_factors), MODEL_DIR)
+
+# Cached rankings also depend on how they were scored, so switching the
+# index or its probe count does not serve rankings from the old setting.
+RANKED_VERSION = (
+    f"{MODEL_VERSION}:exact"
+    if ann_index is None
+    else f"{MODEL_VERSION}:ivf{len(ann_index.centroids)}x{IVF_NPROBE}"
+)
 
 
 def process_film_id(film_id):
@@ -24,18 +58,26 @@ def process_film_id(film_id):
     return f"/{film_id}/"
 
 
-def get_live_recommendations(film_ids_raw, ratings, likes, is_seed, N=10):
-    valid_indices = []
-    valid_mask = []
+def process_film_ids(film_ids):
+    """Vectorized :func:`process_film_id` over an array of film urls."""
+    film_ids = np.asarray(film_ids, dtype=str)
+    first = np.strings.find(film_ids, "/", 1)
+    second = np.where(first >= 0, np.strings.find(film_ids, "/", first + 1), -1)
+    end = np.where(second >= 0, second, np.strings.str_len(film_ids))
+    return np.strings.add(np.strings.slice(film_ids, 0, end), "/")
 
-    for i, fid in enumerate(film_ids_raw):
-        if fid in item_map:
-            valid_indices.append(item_map[fid])
-            valid_mask.append(i)
 
-    if not valid_indices:
-        return []
+def films_for(indices):
+    return id_to_film[np.asarray(indices, dtype=np.int64)].tolist()
+
+
+def build_interactions(film_ids_raw, ratings, likes, is_seed):
+    """Resolve film ids to item indices and their confidences."""
+    indices, valid_mask = item_map.resolve(film_ids_raw)
+    if not valid_mask.any():
+        return None
 
+    valid_indices = indices[valid_mask]
     ratings = ratings[valid_mask]
     likes = likes[valid_mask]
 
@@ -52,121 +94,270 @@ def get_live_recommendations(film_ids_raw, ratings, likes, is_seed, N=10):
     raw_scores = 1 + ratio_scores + (likes * 1.5)
     confidences = 1 + alpha * raw_scores
 
-    row_indices = np.zeros(len(valid_indices))
-    col_indices = np.array(valid_indices)
+    return valid_indices, confidences
 
-    user_interactions = csr_matrix(
-        (confidences, (row_indices, col_indices)),
-        shape=(1, model.item_factors.shape[0]),
-    )
 
-    ids, _ = model.recommend(
-        userid=0,
-        user_items=user_interactions,
-        N=N,
-        recalculate_user=True,
-        filter_already_liked_items=True,
-    )
+def rank_live(film_ids_raw, ratings, likes, is_seed, N=10):
+    """Top ``N`` item indices for one interaction set, best first."""
+    interactions = build_interactions(film_ids_raw, ratings, likes, is_seed)
+    if interactions is None:
+        return np.array([], dtype=np.int64)
+
+    col_indices, confidences = interactions
 
-    recommended_films = [id_to_film[i] for i in ids]
+    if ann_index is not None:
+        user_vector = solver.solve(col_indices, confidences)
+        ids = ann_index.search(user_vector, N, exclude=col_indices)
+    else:
+        ids = solver.recommend(col_indices, confidences, N)
+    return ids
+
+
+def get_live_recommendations(film_ids_raw, ratings, likes, is_seed, N=10):
+    recommended_films = films_for(rank_live(film_ids_raw, ratings, likes, is_seed, N))
     return recommended_films
 
 
-BATCH = 10
+# Rows scored per matrix product; bounds the (rows x items) score buffer.
+SCORE_CHUNK = 256
+
+
+def get_batch_recommendations(requests, N=10):
+    """Recommend for many interaction sets at once.
+
+    ``requests`` is a list of ``(film_ids_raw, ratings, likes, is_seed)``.
+    All user vectors are recalculated from one stacked sparse matrix, then
+    scored with one matrix product and a per-row top-k per chunk. Returns a
+    list of film id lists in request order.
+    """
+    rows = []
+    cols = []
+    data = []
+    order = []  # request index of each matrix row
+    for i, (film_ids_raw, ratings, likes, is_seed) in enumerate(requests):
+        interactions = build_interactions(film_ids_raw, ratings, likes, is_seed)
+        if interactions is None:
+            continue
+        col_indices, confidences = interactions
+        rows.append(np.full(len(col_indices), len(order)))
+        cols.append(col_indices)
+        data.append(confidences)
+        order.append(i)
+
+    results = [[] for _ in requests]
+    if not order:
+        return results
+
+    n_items = model.item_factors.shape[0]
+    user_items = csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(order), n_items),
+    )
+
+    user_factors = model.recalculate_user(np.arange(len(order)), user_items)
+    item_factors = np.asarray(model.item_factors)
+    N = min(N, n_items)
 
+    for start in range(0, len(order), SCORE_CHUNK):
+        end = min(start + SCORE_CHUNK, len(order))
+        scores = user_factors[start:end] @ item_factors.T
 
-async def compute_ranked_by_user_id(user_id: str, k: int = 1000) -> list[str]:
-    seen = set()
-    raw_film_ids = []
-    raw_ratings = []
-    raw_likes = []
+        # filter already liked items
+        chunk = user_items[start:end]
+        scores[np.repeat(np.arange(end - start), np.diff(chunk.indptr)), chunk.indices] = -np.inf
 
-    page = 1
-    async with AsyncSession(impersonate="chrome") as session:
-        while True:
-            tasks = [
-                get_user_diary_page(session, user_id, page + i) for i in range(BATCH)
-            ]
-            pages = await asyncio.gather(*tasks)
+        top = np.argpartition(-scores, N - 1, axis=1)[:, :N]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
 
-            if all(not p for p in pages):
-                break
+        for row, ids in enumerate(top):
+            row_scores = scores[row, ids]
+            results[order[start + row]] = films_for(ids[np.isfinite(row_scores)])
 
-            for data in pages:
-                if not data:
-                    continue
+    return results
 
-                for r in data:
-                    fid = r.get("film_id")
-                    if not fid:
-                        continue
-                    fid = process_film_id(fid)
 
-                    if fid in seen:
-                        continue
+def user_arrays(entries):
+    """Turn ``(film_id, rating, liked)`` diary entries into model inputs.
 
-                    seen.add(fid)
+    Film urls are normalised in one pass and only the first (newest) entry
+    for each film is kept.
+    """
+    if not entries:
+        return np.array([], dtype=str), np.array([]), np.array([])
 
-                    rating = r.get("rating")
-                    liked = r.get("liked", False)
+    film_ids, ratings, likes = zip(*entries)
+    film_ids = process_film_ids(film_ids)
+    _, first = np.unique(film_ids, return_index=True)
+    keep = np.sort(first)
 
-                    r_val = (
-                        float(rating) if (rating is not None and rating > 0) else 0.0
-                    )
-                    l_val = 1.0 if liked else 0.0
+    ratings = np.asarray(ratings, dtype=np.float64)[keep]
+    likes = np.asarray(likes, dtype=np.float64)[keep]
+    return film_ids[keep], np.where(ratings > 0, ratings, 0.0), likes
 
-                    raw_film_ids.append(fid)
-                    raw_ratings.append(r_val)
-                    raw_likes.append(l_val)
 
-            page += BATCH
+async def compute_ranked_by_user_id(user_id: str, k: int = 1000):
+    raw_film_ids, raw_ratings, raw_likes = user_arrays(await sync_interactions(user_id))
 
     if len(raw_film_ids) < 2:
-        return []
+        return np.array([], dtype=np.int64)
 
-    return get_live_recommendations(
-        np.array(raw_film_ids), np.array(raw_ratings), np.array(raw_likes), False, N=k
-    )
+    return rank_live(raw_film_ids, raw_ratings, raw_likes, False, N=k)
 
 
-async def compute_ranked_by_seeds(seed_film_ids: list[str], k: int = 1000) -> list[str]:
+async def compute_ranked_by_seeds(seed_film_ids: list[str], k: int = 1000):
     if not seed_film_ids:
-        return []
+        return np.array([], dtype=np.int64)
 
     ratings = np.array([5.0] * len(seed_film_ids))
     likes = np.array([1.0] * len(seed_film_ids))
 
-    return get_live_recommendations(np.array(seed_film_ids), ratings, likes, True, N=k)
+    return rank_live(np.array(seed_film_ids), ratings, likes, True, N=k)
+
+
+BATCH_USER_CONCURRENCY = int(os.environ.get("BATCH_USER_CONCURRENCY", "8"))
+
+
+async def compute_ranked_batch(user_ids: list[str], seed_sets: list[list[str]], k: int = 100):
+    """Rank for many users and seed sets with one vectorized scoring pass."""
+    semaphore = asyncio.Semaphore(BATCH_USER_CONCURRENCY)
 
+    async def load(user_id):
+        async with semaphore:
+            try:
+                return user_arrays(await sync_interactions(user_id))
+            except UpstreamError:
+                return None
 
-PER_PAGE = 1000
+    loaded = await asyncio.gather(*[load(u) for u in user_ids])
+    requests = []
+    for arrays in loaded:
+        film_ids, ratings, likes = arrays or user_arrays([])
+        if len(film_ids) < 2:
+            film_ids = np.array([], dtype=str)
+        requests.append((film_ids, ratings, likes, False))
 
+    for seeds in seed_sets:
+        # the same canonical seed set /recommend/seed scores
+        seeds = np.array(films_for(canonical_seeds(seeds)[0]), dtype=str)
+        requests.append((seeds, np.full(len(seeds), 5.0), np.ones(len(seeds)), True))
 
-def paginate_ranked(ranked, page: int):
-    start = (page - 1) * PER_PAGE
-    end = start + PER_PAGE
-    return ranked[start:end]
+    ranked = await asyncio.to_thread(get_batch_recommendations, requests, k)
+    return {
+        # users whose diary could not be fetched get null, not an empty list
+        "users": {
+            user_id: None if arrays is None else films
+            for user_id, arrays, films in zip(user_ids, loaded, ranked)
+        },
+        "seeds": ranked[len(user_ids):],
+    }
 
 
-async def get_ranked_cached(user_id: str, page: int):
+# How many recommendations are computed and cached per user or seed set;
+# requests page through this list with ``k`` and ``offset``.
+RANKED_SIZE = 1000
+
+# Cached rankings are packed little-endian int32 item indices, so a page is
+# one GETRANGE of ``4 * k`` bytes instead of unpickling the whole list.
+RANKED_DTYPE = np.dtype("<i4")
+
+# Rankings older than the soft timeout are served while a background task
+# recomputes them; the hard timeout bounds how stale they can get.
+RANKED_SOFT_TIMEOUT = int(os.environ.get("RANKED_SOFT_TIMEOUT", "360"))
+RANKED_TIMEOUT = int(os.environ.get("RANKED_TIMEOUT", "86400"))
+
+
+async def ranked_slice(key: str, compute, k: int, offset: int = 0, name: str = "ranked") -> list[str]:
+    """Films ``offset .. offset + k`` of the ranking cached under ``key``.
+
+    On a miss ``compute`` produces the full ranking (item indices), which is
+    stored packed and sliced locally. Hits and misses are counted under
+    ``name``.
+    """
+    key = f"{key}:{RANKED_VERSION}"
+    size = RANKED_DTYPE.itemsize
+    raw, fresh = await cache.get_range_marked(
+        key, fresh_key(key), offset * size, (offset + k) * size - 1
+    )
+    if raw is not None:
+        incr(f"{name}.hit")
+        if not fresh:
+            incr(f"{name}.stale")
+            refresh_in_background(cache, key, lambda: _refresh_ranked(key, compute))
+        return films_for(np.frombuffer(raw, dtype=RANKED_DTYPE))
+
+    incr(f"{name}.miss")
+    ranked = await flight.do(key, lambda: _fill_ranked(key, compute))
+    return films_for(ranked[offset:offset + k])
+
+
+async def _fill_ranked(key: str, compute):
+    async def fill():
+        ranked = np.asarray(await compute(), dtype=RANKED_DTYPE)
+        await _store_ranked(key, ranked)
+        return ranked
+
+    return await locked_fill(cache, key, fill, lambda: _read_ranked(key))
+
+
+async def _read_ranked(key: str):
+    raw = await cache.get_range(key, 0, -1)
+    return None if raw is None else np.frombuffer(raw, dtype=RANKED_DTYPE)
+
+
+async def _refresh_ranked(key: str, compute):
+    # An empty result usually means the diary could not be fetched; keep
+    # serving the stale ranking instead.
+    ranked = np.asarray(await compute(), dtype=RANKED_DTYPE)
+    if not len(ranked):
+        return False
+    await _store_ranked(key, ranked)
+    return True
+
+
+async def _store_ranked(key: str, ranked):
+    await cache.set_raw(key, ranked.tobytes(), timeout=RANKED_TIMEOUT)
+    await cache.set(fresh_key(key), True, timeout=RANKED_SOFT_TIMEOUT)
+
+
+async def get_ranked_cached(user_id: str, k: int = RANKED_SIZE, offset: int = 0):
     key = f"ranked:{user_id}"
 
-    ranked = cache.get(key)
-    if ranked is not None:
-        return paginate_ranked(ranked, page)
+    return await ranked_slice(
+        key, lambda: compute_ranked_by_user_id(user_id, RANKED_SIZE), k, offset
+    )
+
+
+def canonical_seeds(seed_film_ids: list[str]):
+    """Sorted, de-duplicated item indices of the seeds the model knows.
 
-    ranked = await compute_ranked_by_user_id(user_id, 1000)
-    cache.set(key, ranked)
-    return paginate_ranked(ranked, page)
+    Also returns whether that differs from the request as given.
+    """
+    indices, found = item_map.resolve(np.array(seed_film_ids, dtype=str))
+    canonical = np.unique(indices[found]).astype(RANKED_DTYPE)
+    return canonical, not np.array_equal(canonical, indices)
 
 
-async def get_ranked_by_seeds_cached(seed_film_ids: list[str], page: int):
-    key = f"ranked_seeds:{'-'.join(seed_film_ids)}"
+def seeds_key(indices) -> str:
+    """Fixed-length cache key for a canonical seed set."""
+    digest = hashlib.blake2b(np.ascontiguousarray(indices).tobytes(), digest_size=16)
+    return f"ranked_seeds:{digest.hexdigest()}"
 
-    ranked = cache.get(key)
-    if ranked is not None:
-        return paginate_ranked(ranked, page)
 
-    ranked = await compute_ranked_by_seeds(seed_film_ids, 1000)
-    cache.set(key, ranked)
-    return paginate_ranked(ranked, page)
+async def get_ranked_by_seeds_cached(seed_film_ids: list[str], k: int = RANKED_SIZE, offset: int = 0):
+    # Order, duplicates and unknown slugs do not change the seed set, so
+    # requests that differ only in those share one cached ranking.
+    indices, changed = canonical_seeds(seed_film_ids)
+    if not len(indices):
+        return []
+    if changed:
+        incr("ranked_seeds.canonicalized")
+
+    seeds = films_for(indices)
+    return await ranked_slice(
+        seeds_key(indices),
+        lambda: compute_ranked_by_seeds(seeds, RANKED_SIZE),
+        k,
+        offset,
+        name="ranked_seeds",
+    )
@@ -1,16 +1,25 @@
-import asyncio
+import os
 import re
+from urllib.parse import quote_plus
 
-from bs4 import BeautifulSoup
-from curl_cffi.requests import AsyncSession
-
-from src.film import get_film_by_id
+from src.film import get_films_within
+from src.parser import extract_text, parse_html, run_parser
+from src.session import get_session
+from src.typeahead import normalize_query
 from src.utils import fetch_html
-from src.cache import cache_slow
 
 
-def extract_text(element):
-    return element.get_text(strip=True) if element else None
+# Results without a poster in the markup are enriched from their film page,
+# at most this many per search.
+SEARCH_ENRICH_LIMIT = int(os.environ.get("SEARCH_ENRICH_LIMIT", "5"))
+SEARCH_ENRICH_TIMEOUT = float(os.environ.get("SEARCH_ENRICH_TIMEOUT", "5"))
+
+SEARCH_TIMEOUT = int(os.environ.get("SEARCH_TIMEOUT", str(7 * 86400)))
+# Results still missing posters are cached briefly so the next search picks
+# up what the background scrapes put in the film cache.
+SEARCH_PARTIAL_TIMEOUT = int(os.environ.get("SEARCH_PARTIAL_TIMEOUT", "300"))
+
+YEAR_IN_NAME = re.compile(r"\((\d{4})\)\s*$")
 
 
 def upscale_poster(url):
@@ -20,63 +29,100 @@ def upscale_poster(url):
     return new_url
 
 
-async def fetch_film_details(film_id):
-    """Fetch film details with caching."""
-    key = f"film:{film_id}"
-    cached = cache_slow.get(key)
-    if cached:
-        return film_id, cached
-    
-    film_details = await get_film_by_id(film_id)
-    cache_slow.set(key, film_details)
-    return film_id, film_details
+def result_poster(elem):
+    img = elem.select_one("img")
+    src = img.get("src") if img else None
+    # lazy-loaded results only carry a placeholder image
+    if not src or "empty-poster" in src:
+        return None
+    return upscale_poster(src)
 
 
-async def parse_search(html):
-    soup = BeautifulSoup(html, "html.parser")
-    datas = []
-    results = soup.select(".search-result")
-    
-    film_tasks = []
+def result_year(result, name):
+    year = extract_text(result.select_one(".metadata a")) or extract_text(result.select_one(".metadata"))
+    if year and year.isdigit():
+        return year
+    match = YEAR_IN_NAME.search(name or "")
+    return match.group(1) if match else None
+
+
+def parse_search_results(html):
+    soup = parse_html(html)
     film_info_map = {}
-    
-    for result in results:
+
+    for result in soup.select(".search-result"):
         title_elem = result.select_one("article > div")
         if not title_elem:
             continue
-            
+
         title = title_elem.get("data-item-name")
         film_id = title_elem.get("data-item-link")
-        
-        film_info_map[film_id] = {"title": title}
-        film_tasks.append(fetch_film_details(film_id))
-    
-    film_results = await asyncio.gather(*film_tasks, return_exceptions=True)
-    
-    # Process results
-    for film_id, film_details in film_results:
-        if isinstance(film_details, Exception):
-            continue  # Skip failed requests
-        if film_details is None:
-            continue
-            
-        info = film_info_map.get(film_id, {})
-        datas.append({
-            "title": info.get("title"),
+
+        film_info_map[film_id] = {
+            "title": title,
+            "year": result_year(result, title),
+            "poster": result_poster(title_elem),
+        }
+
+    return film_info_map
+
+
+async def enrich(film_ids):
+    """Film details for ``film_ids``, or nothing if they take over the time budget.
+
+    Scrapes that run over finish in the background and fill the film cache
+    for the next search.
+    """
+    return await get_films_within(film_ids, SEARCH_ENRICH_TIMEOUT, "search.enrich_timeout")
+
+
+async def parse_search(html, details=False):
+    """Search results built from the result markup.
+
+    Posters missing from the markup are filled in from up to
+    ``SEARCH_ENRICH_LIMIT`` film pages; ``details`` attaches the full film
+    details of every result instead.
+    """
+    film_info_map = await run_parser(parse_search_results, html)
+
+    if details:
+        wanted = list(film_info_map)
+    else:
+        wanted = [film_id for film_id, info in film_info_map.items() if not info["poster"]]
+        wanted = wanted[:SEARCH_ENRICH_LIMIT]
+    film_results = await enrich(wanted)
+
+    datas = []
+    for film_id, info in film_info_map.items():
+        film_details = film_results.get(film_id)
+        data = {
+            "title": info["title"],
             "film_id": film_id,
-            "poster": film_details.get("poster")
-        })
-    
+            "year": info["year"],
+            "poster": info["poster"] or (film_details or {}).get("poster"),
+        }
+        if details:
+            data["details"] = film_details
+        datas.append(data)
+
     return datas
 
 
-async def get_film_by_name(query):
-    parse_query = query.replace(" ", "+")
+def search_timeout(datas, details=False):
+    """Cache timeout for search results; ``None`` keeps them out of the cache."""
+    if details and any(data["details"] is None for data in datas):
+        return None
+    if any(data["poster"] is None for data in datas):
+        return SEARCH_PARTIAL_TIMEOUT
+    return SEARCH_TIMEOUT
+
+
+async def get_film_by_name(query, details=False):
+    parse_query = quote_plus(normalize_query(query))
     url = f"https://letterboxd.com/s/search/films/{parse_query}/?adult&__csrf=345180edbc0f151f1f26"
-    async with AsyncSession(impersonate="chrome") as session:
-        html = await fetch_html(session, url)
-        if not html:
-            return None
+    html = await fetch_html(get_session(), url)
+    if not html:
+        return None
 
-        data = await parse_search(html)
-        return data
+    data = await parse_search(html, details)
+    return data
@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+from curl_cffi import AsyncCurl, CurlHttpVersion, CurlMOpt, lib
+from curl_cffi.requests import AsyncSession
+
+# libcurl CURLPIPE_MULTIPLEX: share one HTTP/2 connection between requests
+CURLPIPE_MULTIPLEX = 2
+
+MAX_CLIENTS = int(os.environ.get("HTTP_MAX_CLIENTS", "64"))
+MAX_HOST_CONNECTIONS = int(os.environ.get("HTTP_MAX_HOST_CONNECTIONS", "8"))
+MAX_TOTAL_CONNECTIONS = int(os.environ.get("HTTP_MAX_TOTAL_CONNECTIONS", "32"))
+
+
+class SessionPool:
+    """Long-lived impersonating session shared by every request.
+
+    The session keeps a pool of ``max_clients`` curl handles on a single
+    multi handle, so TLS connections stay alive and are multiplexed over
+    HTTP/2 instead of being renegotiated per call. The pool is bound to
+    the event loop it was started on.
+    """
+
+    def __init__(
+        self,
+        max_clients: int = MAX_CLIENTS,
+        max_host_connections: int = MAX_HOST_CONNECTIONS,
+        max_total_connections: int = MAX_TOTAL_CONNECTIONS,
+    ):
+        self.max_clients = max_clients
+        self.max_host_connections = max_host_connections
+        self.max_total_connections = max_total_connections
+        self._loop = None
+        self._session = None
+
+    def _setup(self, loop):
+        acurl = AsyncCurl(loop=loop)
+        acurl.setopt(CurlMOpt.PIPELINING, CURLPIPE_MULTIPLEX)
+        acurl.setopt(CurlMOpt.MAX_HOST_CONNECTIONS, self.max_host_connections)
+        acurl.setopt(CurlMOpt.MAX_TOTAL_CONNECTIONS, self.max_total_connections)
+
+        self._loop = loop
+        self._session = AsyncSession(
+            loop=loop,
+            async_curl=acurl,
+            max_clients=self.max_clients,
+            impersonate="chrome",
+            http_version=CurlHttpVersion.V2TLS,
+        )
+
+    async def start(self):
+        if self._session is None:
+            self._setup(asyncio.get_running_loop())
+
+    async def close(self):
+        session = self._session
+        self._loop = None
+        self._session = None
+        if session is not None:
+            await session.close()
+
+    def get(self) -> AsyncSession:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Started lazily, or the previous loop is gone; connections
+            # cannot be shared across loops so the pool is rebuilt.
+            if self._session is not None:
+                _discard(self._session, self._loop)
+            self._setup(loop)
+        return self._session
+
+
+def _discard(session: AsyncSession, loop):
+    """Release a session left behind on another event loop."""
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+        return
+
+    # The loop is gone, so close() cannot cancel its timers or readers;
+    # free the multi handle and the curl handles directly.
+    acurl = session.acurl
+    if acurl._curlm is not None:
+        for curl in list(acurl._curl2future):
+            lib.curl_multi_remove_handle(acurl._curlm, curl._curl)
+            curl.close()
+        lib.curl_multi_cleanup(acurl._curlm)
+        acurl._curlm = None
+    while not session.pool.empty():
+        curl = session.pool.get_nowait()
+        if curl:
+            curl.close()
+    session._closed = True
+
+
+pool = SessionPool()
+
+
+def get_session() -> AsyncSession:
+    return pool.get()
@@ -0,0 +1,37 @@
+import asyncio
+
+from src.metrics import incr
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key runs ``fn``; everyone arriving while it is
+    in flight awaits the same task and gets the same result or exception.
+    The task is shielded so a cancelled caller does not abort the work the
+    other waiters depend on.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._calls: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            incr(f"{self.name}.shared")
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
+
+
+flight = SingleFlight()
@@ -0,0 +1,82 @@
+"""In-process prefix index for search-as-you-type.
+
+Seeded with every film slug the model knows and extended with the titles of
+past search results, so typeahead requests never reach Letterboxd.
+"""
+
+import unicodedata
+from bisect import bisect_left
+
+TYPEAHEAD_LIMIT = 10
+
+
+def normalize_query(query: str) -> str:
+    """Fold unicode compatibility forms, case and whitespace."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+def slug_title(film_id: str) -> str:
+    """``/film/the-dark-knight/`` -> ``the dark knight``."""
+    slug = film_id.strip("/").split("/")[-1]
+    return slug.replace("-", " ")
+
+
+class PrefixIndex:
+    """Sorted normalised names with the film each one points to.
+
+    A prefix lookup is one ``bisect`` plus a scan over the matches.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.film_ids = []
+        self.titles = {}  # film_id -> display title from search results
+
+    def build(self, film_ids):
+        """Replace the index with the slugs in ``film_ids``."""
+        entries = sorted({(normalize_query(slug_title(f)), f) for f in map(str, film_ids)})
+        self.keys = [key for key, _ in entries]
+        self.film_ids = [film_id for _, film_id in entries]
+
+    def add(self, title: str, film_id: str):
+        key = normalize_query(title)
+        if not key:
+            return
+        self.titles[film_id] = title
+
+        pos = bisect_left(self.keys, key)
+        end = pos
+        while end < len(self.keys) and self.keys[end] == key:
+            if self.film_ids[end] == film_id:
+                return
+            end += 1
+        self.keys.insert(pos, key)
+        self.film_ids.insert(pos, film_id)
+
+    def add_results(self, results):
+        """Index the titles of ``/search`` results."""
+        for result in results or []:
+            if result.get("title") and result.get("film_id"):
+                self.add(result["title"], result["film_id"])
+
+    def search(self, prefix: str, limit: int = TYPEAHEAD_LIMIT):
+        prefix = normalize_query(prefix)
+        if not prefix:
+            return []
+
+        matches = []
+        seen = set()
+        pos = bisect_left(self.keys, prefix)
+        while pos < len(self.keys) and len(matches) < limit and self.keys[pos].startswith(prefix):
+            film_id = self.film_ids[pos]
+            if film_id not in seen:
+                seen.add(film_id)
+                matches.append({"film_id": film_id, "title": self.titles.get(film_id, self.keys[pos])})
+            pos += 1
+        return matches
+
+    def __len__(self):
+        return len(self.keys)
+
+
+index = PrefixIndex()
@@ -1,15 +1,18 @@
-import asyncio
+import os
 from typing import Optional
 
-from bs4 import BeautifulSoup
-
-from src.film import get_film_by_id
+from src.cache import cache_aside, cache_slow
+from src.film import get_films
+from src.parser import parse_html, parse_last_page, run_parser
 from src.utils import fetch_html
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0",
 }
 
+# Favourites change rarely; the film details behind them are cached separately.
+FAVORITES_TIMEOUT = int(os.environ.get("FAVORITES_TIMEOUT", "21600"))
+
 
 def convert_stars_to_number(star_str: Optional[str]) -> Optional[float]:
     if not star_str:
@@ -24,8 +27,22 @@ def clean_film_url(raw_href: Optional[str]) -> Optional[str]:
 
 
 def parse_diary(html: str):
-    soup = BeautifulSoup(html, "html.parser")
+    return diary_entries(parse_html(html))
+
+
+def parse_diary_page(html: str):
+    soup = parse_html(html)
+    return {
+        "entries": diary_entries(soup),
+        "last_page": parse_last_page(soup),
+        # grid items before any are skipped, to tell a short page from a full one
+        "rows": len(soup.select(".griditem")),
+    }
+
+
+def diary_entries(soup):
     rows = soup.select(".griditem")
+    entries = []
 
     for row in rows:
         component = row.select_one(".react-component")
@@ -37,22 +54,18 @@ def parse_diary(html: str):
         rating_el = viewing_data.select_one(".rating")
         like_icon = bool(viewing_data.select_one(".icon-liked"))
 
-        yield {
+        entries.append({
             "film_href": film_a,
-            "rating": rating_el.get_text(strip=True) if rating_el else None,
+            "rating": rating_el.text(strip=True) if rating_el else None,
             "liked": like_icon,
-        }
-
+        })
 
-async def scrape_user(session, user_id: str, page: int):
-    datas = []
-    diary_url = f"https://letterboxd.com{user_id}films/page/{page}/"
+    return entries
 
-    html = await fetch_html(session, diary_url)
-    if not html:
-        return []
 
-    for entry in parse_diary(html):
+def diary_datas(user_id: str, entries):
+    datas = []
+    for entry in entries:
         film_id = clean_film_url(entry["film_href"])
         if not film_id:
             continue
@@ -68,37 +81,63 @@ async def scrape_user(session, user_id: str, page: int):
     return datas
 
 
+async def scrape_user(session, user_id: str, page: int):
+    diary_url = f"https://letterboxd.com{user_id}films/page/{page}/"
+
+    html = await fetch_html(session, diary_url)
+    if not html:
+        return []
+
+    return diary_datas(user_id, await run_parser(parse_diary, html))
+
+
 async def get_user_diary_page(session, user_id: str, page: int):
     formatted_uid = f"/{user_id}/"
     return await scrape_user(session, formatted_uid, page)
 
 
+async def get_user_diary_page_info(session, user_id: str, page: int):
+    """Like :func:`get_user_diary_page`, returning ``(datas, last_page, rows)``.
+
+    ``last_page`` is the paginator's last page (``None`` without one) and
+    ``rows`` the number of grid items on the page, skipped ones included.
+    """
+    formatted_uid = f"/{user_id}/"
+    diary_url = f"https://letterboxd.com{formatted_uid}films/page/{page}/"
+
+    html = await fetch_html(session, diary_url)
+    if not html:
+        return [], None, 0
+
+    parsed = await run_parser(parse_diary_page, html)
+    return diary_datas(formatted_uid, parsed["entries"]), parsed["last_page"], parsed["rows"]
+
+
 def parse_favorites(html: str):
-    soup = BeautifulSoup(html, "html.parser")
+    soup = parse_html(html)
     favorites = soup.select("#favourites .favourite-production-poster-container > div")
 
-    for film in favorites:
-        film_id = film.get("data-item-link")
-        if film_id:
-            yield film_id
+    return [film.get("data-item-link") for film in favorites if film.get("data-item-link")]
 
 
-async def get_user_favorites_handler(session, user_id: str):
+async def get_user_favorite_ids(session, user_id: str):
     formatted_uid = f"/{user_id}/"
     html = await fetch_html(session, f"https://letterboxd.com{formatted_uid}")
     if not html:
+        return None
+
+    return await run_parser(parse_favorites, html)
+
+
+async def get_user_favorites_handler(session, user_id: str):
+    film_ids = await cache_aside(
+        cache_slow,
+        f"favorites:{user_id}",
+        lambda: get_user_favorite_ids(session, user_id),
+        timeout=FAVORITES_TIMEOUT,
+    )
+    if not film_ids:
         return []
 
-    film_ids = list(parse_favorites(html))
-    
-    # Fetch all film details concurrently
-    tasks = [get_film_by_id(film_id) for film_id in film_ids]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # Filter out exceptions and None results
-    datas = [
-        result for result in results 
-        if not isinstance(result, Exception) and result is not None
-    ]
-    
-    return datas
+    details = await get_films(film_ids)
+    return [data for data in details.values() if data is not None]
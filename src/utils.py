@@ -1,10 +1,10 @@
+from src.governor import governor
+
+
 async def fetch_html(session, url):
-    try:
-        response = await session.get(url, timeout=30)
-        if response.status_code == 200:
-            return response.text
-        print(f"Failed with status: {response.status_code}")
-        return None
-    except Exception as e:
-        print(f"Error fetching {url}: {e}")
-        return None
+    """Page body, or ``None`` if it does not exist.
+
+    Raises :class:`src.governor.UpstreamError` when the upstream keeps
+    failing, so a failure is never mistaken for an empty page.
+    """
+    return await governor.fetch(session, url)
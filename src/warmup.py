@@ -0,0 +1,70 @@
+"""Fill the film metadata store for every film the model can recommend.
+
+    python -m src.warmup [--concurrency 8] [--batch 200] [--limit N]
+
+Films already in the store are skipped, so an interrupted run picks up
+where it stopped.
+"""
+
+import argparse
+import asyncio
+import time
+
+from src.film import get_film_by_id, normalize_film_id
+from src.metadata_store import film_slug, metadata_store
+from src.model_store import MODEL_DIR, load_item_ids
+from src.session import pool
+
+
+async def warmup(film_ids, concurrency=8, batch=200):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(film_id):
+        async with semaphore:
+            try:
+                return await get_film_by_id(film_id)
+            except Exception as e:
+                print(f"{film_id}: {e}")
+                return None
+
+    await pool.start()
+    start = time.perf_counter()
+    scraped = skipped = failed = 0
+    try:
+        for offset in range(0, len(film_ids), batch):
+            chunk = film_ids[offset:offset + batch]
+            stored = await metadata_store.get_many([film_slug(f) for f in chunk])
+            missing = [f for f in chunk if film_slug(f) not in stored]
+            skipped += len(chunk) - len(missing)
+
+            results = await asyncio.gather(*[fetch(f) for f in missing])
+            found = {film_slug(f): data for f, data in zip(missing, results) if data is not None}
+            await metadata_store.put_many(found)
+            scraped += len(found)
+            failed += len(missing) - len(found)
+
+            done = offset + len(chunk)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{done}/{len(film_ids)} films: {scraped} scraped, {skipped} already stored, "
+                f"{failed} failed ({elapsed:.0f}s)"
+            )
+    finally:
+        await pool.close()
+        metadata_store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--concurrency", type=int, default=8, help="film pages fetched at once")
+    parser.add_argument("--batch", type=int, default=200, help="films per store write")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N films")
+    args = parser.parse_args()
+
+    film_ids = [normalize_film_id(str(f)) for f in load_item_ids(args.model_dir)[: args.limit]]
+    asyncio.run(warmup(film_ids, args.concurrency, args.batch))
+
+
+if __name__ == "__main__":
+    main()
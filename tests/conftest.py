@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+from scipy.sparse import random as sparse_random
+
+
+@pytest.fixture(scope="session")
+def als_model():
+    """A small ALS model trained on random interactions, with its user-item matrix."""
+    from implicit.cpu.als import AlternatingLeastSquares
+
+    user_items = sparse_random(60, 240, density=0.08, random_state=1, format="csr", dtype=np.float32)
+    user_items.data = (user_items.data * 5 + 1).astype(np.float32)
+
+    model = AlternatingLeastSquares(factors=8, regularization=0.1, alpha=2.0, iterations=10, random_state=0)
+    model.fit(user_items, show_progress=False)
+    return model, user_items
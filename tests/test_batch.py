@@ -0,0 +1,67 @@
+"""Batch scoring must rank every request as the single-request path does."""
+
+import importlib
+import pickle
+
+import numpy as np
+import pytest
+
+from src import model_store
+
+
+@pytest.fixture(scope="module")
+def recomender(als_model, tmp_path_factory):
+    model, _ = als_model
+    model_dir = tmp_path_factory.mktemp("model")
+    n_items, n_users = model.item_factors.shape[0], model.user_factors.shape[0]
+    with open(model_dir / "model.pkl", "wb") as f:
+        pickle.dump(
+            {
+                "model": model,
+                "item_map": {f"/film/f{i}/": i for i in range(n_items)},
+                "user_map": {f"user{i}": i for i in range(n_users)},
+            },
+            f,
+        )
+    model_store.export_model(str(model_dir / "model.pkl"), str(model_dir))
+
+    mp = pytest.MonkeyPatch()
+    mp.setattr(model_store, "MODEL_DIR", str(model_dir))
+    mp.setenv("RECOMMEND_INDEX", "exact")
+    try:
+        yield importlib.import_module("src.recomender")
+    finally:
+        mp.undo()
+
+
+def films(*ids):
+    return np.array([f"/film/f{i}/" for i in ids], dtype=str)
+
+
+REQUESTS = [
+    (films(1, 5, 9, 30, 41), np.array([4.5, 3.0, 0.0, 5.0, 2.0]), np.array([1.0, 0.0, 0.0, 1.0, 0.0]), False),
+    (films(2, 7), np.array([5.0, 5.0]), np.array([1.0, 1.0]), True),
+    (films(3, 3, 8), np.array([5.0, 5.0, 5.0]), np.array([1.0, 1.0, 1.0]), True),
+    (np.array(["/film/unknown/"]), np.array([5.0]), np.array([1.0]), True),
+    (films(*range(100, 160)), np.full(60, 3.5), np.zeros(60), False),
+]
+
+
+def test_batch_matches_single(recomender):
+    batch = recomender.get_batch_recommendations(REQUESTS, N=20)
+    single = [recomender.get_live_recommendations(*request, N=20) for request in REQUESTS]
+    assert batch == single
+
+
+def test_batch_excludes_interacted_and_unknown(recomender):
+    batch = recomender.get_batch_recommendations(REQUESTS, N=20)
+    assert batch[3] == []
+    for (film_ids, *_), ranked in zip(REQUESTS, batch):
+        assert len(ranked) == len(set(ranked))
+        assert not set(ranked) & set(film_ids.tolist())
+
+
+def test_batch_chunks_agree(recomender, monkeypatch):
+    whole = recomender.get_batch_recommendations(REQUESTS, N=20)
+    monkeypatch.setattr(recomender, "SCORE_CHUNK", 2)
+    assert recomender.get_batch_recommendations(REQUESTS, N=20) == whole
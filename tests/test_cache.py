@@ -0,0 +1,196 @@
+"""cache_aside against an in-memory stand-in for RedisCache."""
+
+import asyncio
+
+import pytest
+
+from src import cache as cache_module
+from src.cache import NEGATIVE, cache_aside, cache_aside_many
+
+
+class MemoryStore:
+    """The parts of :class:`RedisCache` the cache helpers use; records timeouts."""
+
+    def __init__(self, name="test"):
+        self.name = name
+        self.values = {}
+        self.timeouts = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def get_many(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    async def set(self, key, value, timeout=None):
+        self.values[key] = value
+        self.timeouts[key] = timeout
+
+    async def set_many(self, mapping, timeout=None):
+        for key, value in mapping.items():
+            await self.set(key, value, timeout)
+
+    async def add(self, key, value, timeout=None):
+        if key in self.values:
+            return False
+        await self.set(key, value, timeout)
+        return True
+
+
+class Loader:
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        value = self.values.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+@pytest.fixture
+def store():
+    return MemoryStore()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_miss_loads_and_stores(store):
+    loader = Loader({"name": "Heat"})
+    assert run(cache_aside(store, "film:heat", loader, timeout=60)) == {"name": "Heat"}
+    assert run(cache_aside(store, "film:heat", loader, timeout=60)) == {"name": "Heat"}
+    assert loader.calls == 1
+    assert store.timeouts["film:heat"] == 60
+
+
+def test_none_is_tombstoned(store):
+    loader = Loader(None, {"name": "Heat"})
+    assert run(cache_aside(store, "film:gone", loader, timeout=60, negative_timeout=5)) is None
+    assert store.values["film:gone"] is NEGATIVE
+    assert store.timeouts["film:gone"] == 5
+
+    # the tombstone answers until it expires
+    assert run(cache_aside(store, "film:gone", loader, timeout=60, negative_timeout=5)) is None
+    assert loader.calls == 1
+
+
+def test_failures_are_not_cached(store):
+    loader = Loader(RuntimeError("upstream down"), {"name": "Heat"})
+    with pytest.raises(RuntimeError):
+        run(cache_aside(store, "film:heat", loader, timeout=60))
+    assert "film:heat" not in store.values
+    assert run(cache_aside(store, "film:heat", loader, timeout=60)) == {"name": "Heat"}
+
+
+def test_timeout_may_depend_on_the_value(store):
+    def timeout(value):
+        return None if value["partial"] else 60
+
+    partial = Loader({"partial": True})
+    assert run(cache_aside(store, "search:heat", partial, timeout=timeout)) == {"partial": True}
+    assert "search:heat" not in store.values
+
+    complete = Loader({"partial": False})
+    run(cache_aside(store, "search:heat", complete, timeout=timeout))
+    assert store.timeouts["search:heat"] == 60
+
+
+def test_many_tombstones_only_explicit_none(store):
+    async def loader(keys):
+        # "b" does not exist; "c" failed and is left out
+        return {"a": 1, "b": None}
+
+    assert run(cache_aside_many(store, ["a", "b", "c"], loader, timeout=60, negative_timeout=5)) == {
+        "a": 1,
+        "b": None,
+        "c": None,
+    }
+    assert store.values == {"a": 1, "b": NEGATIVE}
+    assert store.timeouts["b"] == 5
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    """Isolate refresh bookkeeping and let tests wait for background refreshes."""
+    monkeypatch.setattr(cache_module, "_refresh_failures", type(cache_module._refresh_failures)())
+
+    async def settle():
+        while cache_module._background:
+            await asyncio.gather(*list(cache_module._background))
+
+    return settle
+
+
+def test_fresh_value_is_not_refreshed(store, refreshes):
+    store.values.update({"film:heat": "v1", "film:heat:fresh": True})
+    loader = Loader("v2")
+
+    async def main():
+        value = await cache_aside(store, "film:heat", loader, timeout=60, soft_timeout=10)
+        await refreshes()
+        return value
+
+    assert run(main()) == "v1"
+    assert loader.calls == 0
+
+
+def test_stale_value_is_served_and_refreshed(store, refreshes):
+    store.values["film:heat"] = "v1"  # the fresh marker has expired
+    loader = Loader("v2")
+
+    async def main():
+        value = await cache_aside(store, "film:heat", loader, timeout=60, soft_timeout=10)
+        await refreshes()
+        return value
+
+    assert run(main()) == "v1"
+    assert loader.calls == 1
+    assert store.values["film:heat"] == "v2"
+    assert store.values["film:heat:fresh"] is True
+    assert store.timeouts["film:heat:fresh"] == 10
+
+
+def test_failed_refresh_keeps_the_stale_value(store, refreshes):
+    store.values["film:heat"] = "v1"
+    loader = Loader(RuntimeError("upstream down"), None)
+
+    async def main():
+        await cache_aside(store, "film:heat", loader, timeout=60, soft_timeout=10)
+        await refreshes()
+        # the refresh gate holds back a second attempt within the interval
+        value = await cache_aside(store, "film:heat", loader, timeout=60, soft_timeout=10)
+        await refreshes()
+        return value
+
+    assert run(main()) == "v1"
+    assert loader.calls == 1
+    assert store.values["film:heat"] == "v1"
+    assert "film:heat:fresh" not in store.values
+    assert cache_module._refresh_failures["film:heat"] == 1
+    assert store.timeouts["film:heat:refresh"] == cache_module.REFRESH_INTERVAL
+
+
+def test_refresh_backs_off_after_failures(store, refreshes):
+    store.values["film:heat"] = "v1"
+    cache_module._refresh_failures["film:heat"] = 3
+    loader = Loader(None)
+
+    async def main():
+        await cache_aside(store, "film:heat", loader, timeout=60, soft_timeout=10)
+        await refreshes()
+
+    run(main())
+    expected = min(cache_module.REFRESH_INTERVAL * 8, cache_module.REFRESH_MAX_BACKOFF)
+    assert store.timeouts["film:heat:refresh"] == expected
+    assert cache_module._refresh_failures["film:heat"] == 4
+
+
+def test_stale_fallbacks_get_no_fresh_marker(store, refreshes):
+    loader = Loader(cache_module.Stale("old copy"))
+    assert run(cache_aside(store, "film:heat", loader, timeout=60, soft_timeout=10)) == "old copy"
+    assert store.values["film:heat"] == "old copy"
+    assert "film:heat:fresh" not in store.values
@@ -0,0 +1,109 @@
+"""Retries, throttling and failure handling of upstream fetches."""
+
+import asyncio
+import time
+
+import pytest
+
+from src import governor as governor_module
+from src.governor import Governor, UpstreamError
+
+URL = "https://letterboxd.com/film/heat-1995/"
+
+
+class Response:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class Session:
+    """Answers ``get`` with the queued responses (or raises queued exceptions)."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def get(self, url, timeout=None):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(governor_module, "UPSTREAM_BACKOFF", 0.001)
+
+
+def fetch(session, retries=3):
+    return asyncio.run(Governor(rate=1000, host_rate=1000, retries=retries).fetch(session, URL))
+
+
+def test_ok():
+    session = Session(Response(200, "<html>"))
+    assert fetch(session) == "<html>"
+    assert session.calls == 1
+
+
+def test_not_found_is_none():
+    session = Session(Response(404))
+    assert fetch(session) is None
+    assert session.calls == 1
+
+
+def test_retries_server_errors():
+    session = Session(Response(500), Response(502), Response(200, "<html>"))
+    assert fetch(session) == "<html>"
+    assert session.calls == 3
+
+
+def test_retries_connection_errors():
+    session = Session(ConnectionError("reset"), Response(200, "<html>"))
+    assert fetch(session) == "<html>"
+    assert session.calls == 2
+
+
+def test_gives_up_after_retries():
+    session = Session(*[Response(503)] * 3)
+    with pytest.raises(UpstreamError) as error:
+        fetch(session, retries=2)
+    assert error.value.status == 503
+    assert session.calls == 3
+
+
+def test_client_errors_are_not_retried():
+    session = Session(Response(410), Response(200, "<html>"))
+    with pytest.raises(UpstreamError) as error:
+        fetch(session)
+    assert error.value.status == 410
+    assert session.calls == 1
+
+
+def test_honours_retry_after():
+    session = Session(Response(429, headers={"Retry-After": "0.3"}), Response(200, "<html>"))
+    start = time.monotonic()
+    assert fetch(session) == "<html>"
+    assert time.monotonic() - start >= 0.3
+    assert session.calls == 2
+
+
+def test_long_retry_after_fails_fast():
+    session = Session(Response(429, headers={"Retry-After": "3600"}), Response(200, "<html>"))
+    start = time.monotonic()
+    with pytest.raises(UpstreamError) as error:
+        fetch(session)
+    assert time.monotonic() - start < 1
+    assert session.calls == 1
+    assert error.value.status == 429
+    assert error.value.retry_after > governor_module.UPSTREAM_MAX_BACKOFF
+
+
+def test_throttling_halves_the_host_rate():
+    gov = Governor(rate=1000, host_rate=8, retries=1)
+    session = Session(Response(429), Response(200, "<html>"))
+    assert asyncio.run(gov.fetch(session, URL)) == "<html>"
+    # halved by the 429, then one step back up for the success
+    assert gov.hosts["letterboxd.com"].rate == pytest.approx(4 + governor_module.UPSTREAM_RATE_STEP)
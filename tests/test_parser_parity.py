@@ -0,0 +1,109 @@
+"""The selectolax and BeautifulSoup backends must extract the same data.
+
+Run with ``python -m pytest tests``. The pages in ``fixtures/`` are trimmed
+copies of Letterboxd markup, kept with the quirks the extractors rely on.
+"""
+
+from pathlib import Path
+
+import pytest
+
+from src import parser
+from src.film import parse_film_data
+from src.get_list import parse_list_entries, parse_list_page
+from src.search import parse_search_results
+from src.users import parse_diary, parse_diary_page, parse_favorites
+
+pytest.importorskip("selectolax.lexbor")
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+CASES = [
+    ("film.html", parse_film_data, ("/film/amelie/",)),
+    ("diary.html", parse_diary, ()),
+    ("diary.html", parse_diary_page, ()),
+    ("list.html", parse_list_entries, ()),
+    ("list.html", parse_list_page, ()),
+    ("list_grid.html", parse_list_page, ()),
+    ("favorites.html", parse_favorites, ()),
+    ("search.html", parse_search_results, ()),
+]
+
+
+def fixture(name):
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+def parse_with(monkeypatch, backend, fn, html, *args):
+    monkeypatch.setattr(parser, "HTML_PARSER", backend)
+    return fn(html, *args)
+
+
+@pytest.mark.parametrize(
+    "name, fn, args", CASES, ids=[f"{fn.__name__}-{name}" for name, fn, _ in CASES]
+)
+def test_backends_agree(monkeypatch, name, fn, args):
+    html = fixture(name)
+    lexbor = parse_with(monkeypatch, "lexbor", fn, html, *args)
+    bs4 = parse_with(monkeypatch, "bs4", fn, html, *args)
+    assert lexbor
+    assert lexbor == bs4
+
+
+@pytest.mark.parametrize("backend", ["lexbor", "bs4"])
+def test_film(monkeypatch, backend):
+    data = parse_with(monkeypatch, backend, parse_film_data, fixture("film.html"), "/film/amelie/")
+    assert data["name"] == "Amélie"
+    assert data["year"] == "2001"
+    assert data["director"] == "Jean-Pierre Jeunet"
+    assert data["casts"] == "Audrey Tautou, Mathieu Kassovitz, Rufus"
+    assert data["genres"] == "Comedy, Romance"
+    assert data["poster"].startswith("https://a.ltrbxd.com/resized/film-poster/")
+    assert data["rating"] == "4.11"
+    assert data["duration"] == "122"
+
+
+@pytest.mark.parametrize("backend", ["lexbor", "bs4"])
+def test_diary_page(monkeypatch, backend):
+    page = parse_with(monkeypatch, backend, parse_diary_page, fixture("diary.html"))
+    assert page["last_page"] == 41
+    assert page["rows"] == 5
+    assert [entry["film_href"] for entry in page["entries"]] == [
+        "/film/amelie/",
+        "/film/heat-1995/",
+        "https://letterboxd.com/film/paprika/",
+        "/film/in-the-mood-for-love/",
+    ]
+    assert [entry["liked"] for entry in page["entries"]] == [True, False, False, True]
+    assert page["entries"][2]["rating"] is None
+
+
+@pytest.mark.parametrize("backend", ["lexbor", "bs4"])
+def test_list_page(monkeypatch, backend):
+    page = parse_with(monkeypatch, backend, parse_list_page, fixture("list.html"))
+    assert page["last_page"] == 3
+    assert page["entries"] == [
+        {"title": "Spirited Away (2001)", "film_id": "/film/spirited-away/"},
+        {"title": "Oldboy (2003)", "film_id": "/film/oldboy/"},
+        {"title": "Caché (2005)", "film_id": "/film/hidden/"},
+    ]
+
+    grid = parse_with(monkeypatch, backend, parse_list_page, fixture("list_grid.html"))
+    assert grid["last_page"] is None
+    assert [entry["film_id"] for entry in grid["entries"]] == ["/film/tokyo-story/", "/film/chungking-express/"]
+
+
+@pytest.mark.parametrize("backend", ["lexbor", "bs4"])
+def test_favorites(monkeypatch, backend):
+    favorites = parse_with(monkeypatch, backend, parse_favorites, fixture("favorites.html"))
+    assert favorites == ["/film/amelie/", "/film/heat-1995/", "/film/paprika/"]
+
+
+@pytest.mark.parametrize("backend", ["lexbor", "bs4"])
+def test_search_results(monkeypatch, backend):
+    results = parse_with(monkeypatch, backend, parse_search_results, fixture("search.html"))
+    assert list(results) == ["/film/heat-1995/", "/film/the-heat/", "/film/heat-and-dust/"]
+    assert results["/film/heat-1995/"]["year"] == "1995"
+    assert results["/film/heat-1995/"]["poster"].endswith("-0-230-0-345-crop.jpg?v=2b8f1e")
+    assert results["/film/the-heat/"] == {"title": "The Heat (2013)", "year": "2013", "poster": None}
+    assert results["/film/heat-and-dust/"]["year"] == "1983"
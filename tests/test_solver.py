@@ -0,0 +1,44 @@
+"""The closed-form solve must match implicit's own recalculated users."""
+
+import numpy as np
+import pytest
+
+from src.solver import UserSolver
+
+USERS = range(10)
+
+
+@pytest.fixture(scope="module")
+def solver(als_model):
+    model, _ = als_model
+    return UserSolver(model.item_factors, model.regularization, model.alpha)
+
+
+@pytest.mark.parametrize("user", USERS)
+def test_solve_matches_recalculate_user(als_model, solver, user):
+    model, user_items = als_model
+    row = user_items[user]
+    expected = model.recalculate_user(0, row)
+    assert np.allclose(solver.solve(row.indices, row.data), expected, atol=1e-4)
+
+
+@pytest.mark.parametrize("user", USERS)
+def test_recommend_matches_model(als_model, solver, user):
+    model, user_items = als_model
+    row = user_items[user]
+    expected, _ = model.recommend(0, row, N=20, recalculate_user=True)
+    assert solver.recommend(row.indices, row.data, 20).tolist() == expected.tolist()
+
+
+def test_repeated_items_add_up(solver):
+    indices = np.array([3, 7, 3])
+    confidences = np.array([2.0, 4.0, 5.0])
+    merged = solver.solve(np.array([3, 7]), np.array([7.0, 4.0]))
+    assert np.allclose(solver.solve(indices, confidences), merged)
+
+
+def test_recommend_excludes_seen_items(solver):
+    seen = np.arange(0, 240, 2)
+    ranked = solver.recommend(seen, np.full(len(seen), 3.0), 200)
+    assert len(ranked) == 120
+    assert not np.isin(ranked, seen).any()